@@ -1,4 +1,6 @@
 from pkg_resources import get_distribution
 
+from timeflow.log import Log  # noqa
+
 
 __version__ = get_distribution("timeflow").version
@@ -0,0 +1,84 @@
+import heapq
+import json
+import tempfile
+
+from operator import itemgetter
+
+# maximum number of keys, which are summed up in memory
+AGGREGATION_LIMIT = 100000
+
+
+class SpillingCounter():
+    """
+    Sums up values by keys, keeping no more than `limit` keys in memory
+
+    When the limit is reached, sums are written to a sorted temporary file
+    and memory is cleared. Spilled sums are merged, when items are read.
+    Keys must be tuples of strings or numbers.
+
+    Every key gets a number of the order, in which it was added for the first
+    time, so items can be returned in the same order as from a dict.
+    """
+    def __init__(self, limit=None):
+        if limit is None:
+            limit = AGGREGATION_LIMIT
+        self.limit = limit
+        self._sums = {}
+        self._order = 0
+        self._runs = []
+
+    def add(self, key, value):
+        item = self._sums.get(key)
+        if item is None:
+            if len(self._sums) >= self.limit:
+                self._spill()
+            self._sums[key] = [self._order, value]
+            self._order += 1
+        else:
+            item[1] += value
+
+    def _spill(self):
+        run = tempfile.TemporaryFile('w+')
+        for key, (order, value) in sorted(self._sums.items()):
+            run.write(json.dumps([key, order, value]))
+            run.write('\n')
+        run.seek(0)
+        self._runs.append(run)
+        self._sums = {}
+
+    def _read_run(self, run):
+        for line in run:
+            key, order, value = json.loads(line)
+            yield tuple(key), order, value
+
+    def items(self):
+        """
+        Yields (key, order, sum) tuples, sorted by key
+
+        Sums of the same key from all spilled runs are added up, and order
+        of the key is the order it was added for the first time.
+        """
+        in_memory = ((key, order, value)
+                     for key, (order, value) in sorted(self._sums.items()))
+        if not self._runs:
+            yield from in_memory
+            return
+
+        runs = [self._read_run(run) for run in self._runs] + [in_memory]
+        current_key = current_order = current_value = None
+        for key, order, value in heapq.merge(*runs, key=itemgetter(0)):
+            if key == current_key:
+                current_order = min(current_order, order)
+                current_value += value
+                continue
+            if current_key is not None:
+                yield current_key, current_order, current_value
+            current_key, current_order, current_value = key, order, value
+        if current_key is not None:
+            yield current_key, current_order, current_value
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._sums = {}
@@ -0,0 +1,421 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+from timeflow.entries import Entries
+from timeflow.entries import chain_hash
+from timeflow.entries import read_entries
+from timeflow.utils import DATE_LEN
+from timeflow.utils import DATETIME_FORMAT
+from timeflow.utils import DATETIME_LEN
+from timeflow.utils import MINUTES_IN_DAY
+from timeflow.utils import epoch_minutes_to_datetime
+from timeflow.utils import find_slack
+from timeflow.utils import get_epoch_days
+from timeflow.utils import get_epoch_minutes
+from timeflow.utils import get_file_state
+from timeflow.utils import is_appended
+from timeflow.utils import locked_file
+from timeflow.utils import rewrite_file
+from timeflow.utils import strip_log
+
+MAGIC = b'TFLOG001'
+# magic, generation of the string table file
+HEADER = struct.Struct('<8sQ')
+# minutes since epoch, project string id, log string id, flags
+RECORD = struct.Struct('<iIIB')
+
+# entry is marked as slack
+SLACK = 0x01
+# entry has log message after the project, even if it's empty
+HAS_LOG = 0x02
+# the rest of flags is number of empty lines before the entry
+EMPTY_LINES_SHIFT = 2
+MAX_EMPTY_LINES = 0xff >> EMPTY_LINES_SHIFT
+
+
+def is_binary_log(path):
+    "Returns True if file at `path` is binary log"
+    try:
+        with open(path, 'rb') as fp:
+            return fp.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def get_strings_file(path, generation):
+    """
+    Returns path of string table file of binary log
+
+    String table is append-only, one JSON encoded string per line, so ids
+    of the strings never change. It's replaced only when the whole log is
+    rewritten, then a new file of the next generation is written.
+    """
+    return '{}.{}.strings'.format(path, generation)
+
+
+def read_strings(strings_file):
+    "Returns list of strings of string table file"
+    strings = []
+    with open(strings_file, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            # string being appended at the moment is not complete yet
+            if not line.endswith('\n'):
+                break
+            strings.append(json.loads(line))
+    return strings
+
+
+def _encode_strings(strings):
+    return ''.join(json.dumps(string) + '\n' for string in strings)
+
+
+def render_line(record, strings):
+    "Returns text log line of the record, preceded by its empty lines"
+    minutes, project_id, log_id, flags = record
+    message = strings[project_id]
+    if flags & HAS_LOG:
+        message += ': ' + strings[log_id]
+    return '{}{}: {}\n'.format(
+        '\n' * (flags >> EMPTY_LINES_SHIFT),
+        epoch_minutes_to_datetime(minutes).strftime(DATETIME_FORMAT),
+        message,
+    )
+
+
+def iter_text_lines(path):
+    "Yields text log lines of binary log, including empty lines"
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    _, generation = HEADER.unpack_from(data)
+    strings = read_strings(get_strings_file(path, generation))
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    for record in RECORD.iter_unpack(data[HEADER.size:end]):
+        yield render_line(record, strings)
+
+
+class _StringTable():
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.ids = {string: i for i, string in enumerate(self.strings)}
+        # number of strings, which are already in the string table file
+        self.stored = len(self.strings)
+
+    def get_id(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def new_strings(self):
+        return self.strings[self.stored:]
+
+
+class _StringsFile():
+    """
+    String table file, which strings are not decoded all at once
+
+    Strings are looked up by value right in the bytes of the file, and
+    are decoded by id only when they are needed.
+    """
+    def __init__(self, strings_file):
+        with open(strings_file, 'rb') as fp:
+            data = fp.read()
+        # string being appended at the moment is not complete yet, so only
+        # complete lines are kept, each of them preceded by new line char
+        self.data = b'\n' + data[:data.rfind(b'\n') + 1]
+        self.stored = self.data.count(b'\n') - 1
+        self.lines = None
+        self.strings = {}
+        self.new = []
+
+    def __getitem__(self, string_id):
+        string = self.strings.get(string_id)
+        if string is None:
+            if self.lines is None:
+                self.lines = self.data.split(b'\n')
+            string = self.strings[string_id] = json.loads(
+                self.lines[string_id + 1].decode('utf-8')
+            )
+        return string
+
+    def get_id(self, string):
+        if string in self.new:
+            return self.stored + self.new.index(string)
+        position = self.data.find(
+            b'\n' + json.dumps(string).encode('utf-8') + b'\n'
+        )
+        if position != -1:
+            # id is the number of lines before the string
+            return self.data.count(b'\n', 0, position)
+        self.new.append(string)
+        return self.stored + len(self.new) - 1
+
+    def new_strings(self):
+        return self.new
+
+
+def encode_line(line, strings, empty_lines=0):
+    """
+    Returns record of text log line, adding its project and log to string
+    table
+
+    Raises ValueError if line can't be rendered back exactly as it is.
+    """
+    line = line.rstrip('\n')
+    if line[DATETIME_LEN:DATETIME_LEN + 2] != ': ':
+        raise ValueError("Line is not a log entry")
+    date, line_time = line[:DATE_LEN], line[DATE_LEN + 1:DATETIME_LEN]
+    minutes = get_epoch_minutes(date, line_time)
+
+    message = line[DATETIME_LEN + 2:]
+    project, separator, log = message.partition(': ')
+    flags = empty_lines << EMPTY_LINES_SHIFT
+    if separator:
+        flags |= HAS_LOG
+    if find_slack(project, log):
+        flags |= SLACK
+    record = (minutes, strings.get_id(project), strings.get_id(log), flags)
+
+    rendered = render_line(record, {record[1]: project, record[2]: log})
+    if rendered.lstrip('\n') != line + '\n':
+        raise ValueError("Line can't be stored without changes")
+    return record
+
+
+def encode_lines(lines):
+    """
+    Returns records and string table of text log lines
+
+    Raises ValueError with the line number, if some line can't be stored
+    in binary log exactly as it is.
+    """
+    strings = _StringTable()
+    records = bytearray()
+    empty_lines = 0
+    for i, line in enumerate(lines):
+        if line == '\n':
+            empty_lines += 1
+            continue
+        if empty_lines > MAX_EMPTY_LINES:
+            raise ValueError("Line {}: too many empty lines before it"
+                             .format(i + 1))
+        try:
+            record = encode_line(line, strings, empty_lines)
+        except ValueError as e:
+            raise ValueError("Line {}: {}".format(i + 1, e))
+        records += RECORD.pack(*record)
+        empty_lines = 0
+    if empty_lines:
+        raise ValueError("Empty lines at the end of the log can't be stored")
+    return bytes(records), strings.strings
+
+
+def write_binary_log(path, lines, stat=None):
+    """
+    Writes text log lines as binary log at `path`, replacing the file
+    atomically with `utils.rewrite_file`
+
+    String table of the new log is written into a new file first, so
+    readers of the old log keep using the old string table until the log
+    is replaced. `stat` is stat of the log, which lines were read from,
+    e.g. before it was edited. Returns number of entries written.
+    """
+    records, strings = encode_lines(lines)
+    if not os.path.exists(path):
+        open(path, 'ab').close()
+    old_strings_file = None
+    generation = time.time_ns()
+    strings_file = get_strings_file(path, generation)
+    try:
+        with rewrite_file(path, stat) as tmp_file:
+            with open(path, 'rb') as fp:
+                header = fp.read(HEADER.size)
+            if len(header) == HEADER.size and header.startswith(MAGIC):
+                _, old_generation = HEADER.unpack(header)
+                old_strings_file = get_strings_file(path, old_generation)
+
+            with open(strings_file, 'w', encoding='utf-8') as strings_fp:
+                strings_fp.write(_encode_strings(strings))
+            with open(tmp_file, 'wb') as tmp_fp:
+                tmp_fp.write(HEADER.pack(MAGIC, generation))
+                tmp_fp.write(records)
+    except BaseException:
+        # string table of the log, which is not written, is not needed
+        if os.path.exists(strings_file):
+            os.remove(strings_file)
+        raise
+
+    if old_strings_file and os.path.exists(old_strings_file):
+        os.remove(old_strings_file)
+    return len(records) // RECORD.size
+
+
+def append_line(path, line, new_day=False):
+    """
+    Appends text log line to binary log
+
+    Record is appended with a single write, after new strings it refers to
+    are appended to the string table, so readers never see records with
+    unknown strings. Log is locked meanwhile, so concurrent appends don't
+    give the same id to different strings.
+    """
+    with locked_file(path, 'rb') as fp:
+        _, generation = HEADER.unpack(fp.read(HEADER.size))
+        strings_file = get_strings_file(path, generation)
+        strings = _StringsFile(strings_file)
+        record = encode_line(line, strings, 1 if new_day else 0)
+
+        new_strings = strings.new_strings()
+        if new_strings:
+            with open(strings_file, 'a', encoding='utf-8') as strings_fp:
+                strings_fp.write(_encode_strings(new_strings))
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, RECORD.pack(*record))
+        finally:
+            os.close(fd)
+
+
+def get_last_minutes(path):
+    "Returns time of the last entry of binary log, or None if it's empty"
+    with open(path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        records_count = (size - HEADER.size) // RECORD.size
+        if not records_count:
+            return None
+        fp.seek(HEADER.size + (records_count - 1) * RECORD.size)
+        return RECORD.unpack(fp.read(RECORD.size))[0]
+
+
+class _RecordMinutes():
+    "Sequence of record times of binary log buffer, for bisecting it"
+    def __init__(self, buf):
+        self.buf = buf
+
+    def __len__(self):
+        return (len(self.buf) - HEADER.size) // RECORD.size
+
+    def __getitem__(self, i):
+        return struct.unpack_from('<i', self.buf, HEADER.size + i * RECORD.size)[0]
+
+
+def find_date_range_offsets(buf, date_from, date_to):
+    """
+    Returns byte offsets of the first record of `date_from` and of the
+    record after the last one of `date_to` in binary log buffer
+
+    Records are bisected right in the buffer, e.g. memory mapped log file,
+    without reading all of them.
+    """
+    minutes = _RecordMinutes(buf)
+    begin = bisect.bisect_left(minutes,
+                               get_epoch_days(date_from) * MINUTES_IN_DAY)
+    end = bisect.bisect_left(minutes,
+                             (get_epoch_days(date_to) + 1) * MINUTES_IN_DAY)
+    end = max(begin, end)
+    return (HEADER.size + begin * RECORD.size,
+            HEADER.size + end * RECORD.size)
+
+
+def hash_date_range(path, date_from, date_to):
+    "Returns SHA-1 hash of binary log records from `date_from` to `date_to`"
+    with open(path, 'rb') as fp:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        begin, end = find_date_range_offsets(buf, date_from, date_to)
+        # string ids are valid only within the same generation of the log
+        log_hash = hashlib.sha1(buf[:HEADER.size])
+        log_hash.update(buf[begin:end])
+        return log_hash.hexdigest()
+    finally:
+        buf.close()
+
+
+def _append_records(entries, records, offset, strings):
+    "Appends records, which are at `offset` in binary log, to entries"
+    names = {}
+
+    def name(string_id):
+        string_name = names.get(string_id)
+        if string_name is None:
+            string_name = names[string_id] = strip_log(strings[string_id])
+        return string_name
+
+    for minutes, project_id, log_id, flags in RECORD.iter_unpack(records):
+        entries.append_entry(
+            offset, minutes, name(project_id),
+            name(log_id) if flags & HAS_LOG else '',
+            bool(flags & SLACK),
+        )
+        offset += RECORD.size
+
+
+def read_binary_entries(fp, entries=None):
+    """
+    Returns entries of binary log file opened in binary mode
+
+    Works like `entries.read_entries`: if `entries` of the same log file
+    are passed and the log file was only appended to since they were read,
+    only records appended since are read and added to them.
+    """
+    fp.seek(0)
+    _, generation = HEADER.unpack(fp.read(HEADER.size))
+    file_size = os.fstat(fp.fileno()).st_size
+    # record being appended at the moment is not complete yet
+    size = file_size - (file_size - HEADER.size) % RECORD.size
+
+    offset = 0
+    if (entries is None or entries.file_state is None or
+            not is_appended(fp, entries.file_state)):
+        entries = Entries()
+    else:
+        offset = entries.size
+    fp.seek(offset)
+    data = fp.read(size - offset)
+    entries.log_hash = chain_hash(entries.log_hash, data)
+    entries.size = size
+    entries.file_state = get_file_state(fp, size)
+
+    records = data if offset else data[HEADER.size:]
+    if records:
+        _append_records(entries, records, max(offset, HEADER.size),
+                        _StringsFile(get_strings_file(fp.name, generation)))
+    return entries
+
+
+def read_date_range_entries(path, date_from, date_to):
+    """
+    Returns entries of binary log records from `date_from` to `date_to`
+
+    Records of the range are bisected right in the memory mapped log file,
+    so only they are read, and only strings they refer to are decoded.
+    """
+    with open(path, 'rb') as fp:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        _, generation = HEADER.unpack_from(buf)
+        begin, end = find_date_range_offsets(buf, date_from, date_to)
+        records = buf[begin:end]
+    finally:
+        buf.close()
+    entries = Entries()
+    _append_records(entries, records, begin,
+                    _StringsFile(get_strings_file(path, generation)))
+    return entries
+
+
+def read_log_entries(fp, entries=None):
+    """
+    Returns entries of text or binary log file opened in binary mode, see
+    `entries.read_entries`
+    """
+    fp.seek(0)
+    if fp.read(len(MAGIC)) == MAGIC:
+        return read_binary_entries(fp, entries)
+    return read_entries(fp, entries)
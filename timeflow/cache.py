@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+
+from timeflow import binlog
+from timeflow import utils
+
+# maximum size of all cached results in bytes
+MAX_CACHE_SIZE = 4 * 1024 * 1024
+ENTRY_SUFFIX = '.entry'
+COUNTERS_FILE = 'counters.json'
+
+
+def _entry_file(key):
+    return os.path.join(utils.CACHE_DIR, key + ENTRY_SUFFIX)
+
+
+def _write_file(path, content):
+    "Writes file atomically, so concurrent readers never see partial content"
+    if not os.path.exists(utils.CACHE_DIR):
+        os.makedirs(utils.CACHE_DIR)
+    with utils.atomic_file(path) as tmp_path, open(tmp_path, 'w') as fp:
+        fp.write(content)
+
+
+def get_counters():
+    "Returns dictionary with cache hit and miss counts"
+    try:
+        with open(os.path.join(utils.CACHE_DIR, COUNTERS_FILE)) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {'hits': 0, 'misses': 0}
+
+
+def _count(counter):
+    counters = get_counters()
+    counters[counter] += 1
+    _write_file(os.path.join(utils.CACHE_DIR, COUNTERS_FILE),
+                json.dumps(counters))
+
+
+def _entries():
+    "Returns list of (path, size, last used time) of cache entries"
+    if not os.path.exists(utils.CACHE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(utils.CACHE_DIR):
+        if name.endswith(ENTRY_SUFFIX):
+            path = os.path.join(utils.CACHE_DIR, name)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+    return entries
+
+
+def _get(key):
+    try:
+        with open(_entry_file(key)) as fp:
+            value = fp.read()
+    except IOError:
+        return None
+    # modification time marks when entry was used last time
+    os.utime(_entry_file(key))
+    return value
+
+
+def _set(key, value):
+    _write_file(_entry_file(key), value)
+    evict()
+
+
+def evict(max_size=None):
+    "Removes least recently used entries until cache fits in `max_size`"
+    if max_size is None:
+        max_size = MAX_CACHE_SIZE
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    total_size = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if total_size <= max_size:
+            break
+        os.remove(path)
+        total_size -= size
+
+
+def clear():
+    "Removes all cached results and resets counters"
+    for path, _, _ in _entries():
+        os.remove(path)
+    counters_file = os.path.join(utils.CACHE_DIR, COUNTERS_FILE)
+    if os.path.exists(counters_file):
+        os.remove(counters_file)
+
+
+def log_fingerprint(date_from, date_to):
+    """
+    Returns hash of log file lines from `date_from` to `date_to`
+
+    Lines out of date range do not affect the hash, so results for closed
+    date ranges stay cached while new entries are being logged. Hash is
+    remembered for log file's size and modification time, so log file is
+    not read again until it changes.
+    """
+    stat = os.stat(utils.LOG_FILE)
+    memo_key = _hash([
+        'fingerprint', os.path.abspath(utils.LOG_FILE),
+        stat.st_size, stat.st_mtime_ns, date_from, date_to,
+    ])
+    fingerprint = _get(memo_key)
+    if fingerprint is None and binlog.is_binary_log(utils.LOG_FILE):
+        fingerprint = binlog.hash_date_range(utils.LOG_FILE,
+                                             date_from, date_to)
+        _set(memo_key, fingerprint)
+    elif fingerprint is None:
+        with open(utils.LOG_FILE, 'rb') as fp:
+            data = fp.read()
+        begin, end = utils.find_date_range_offsets(data, date_from, date_to)
+        fingerprint = hashlib.sha1(data[begin:end]).hexdigest()
+        _set(memo_key, fingerprint)
+    return fingerprint
+
+
+def _hash(parts):
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def get_key(date_from, date_to, filter_projects, exclude_projects,
+            output_format, where=None):
+    "Returns cache key of the query result, `where` is query expression"
+    return _hash([
+        os.path.abspath(utils.LOG_FILE),
+        date_from,
+        date_to,
+        sorted(filter_projects),
+        sorted(exclude_projects),
+        output_format,
+        where,
+        log_fingerprint(date_from, date_to),
+    ])
+
+
+def load(key):
+    "Returns cached result or None, if there is no result for `key`"
+    value = _get(key)
+    _count('misses' if value is None else 'hits')
+    return value
+
+
+def save(key, value):
+    "Caches result, evicting least recently used results if cache is full"
+    _set(key, value)
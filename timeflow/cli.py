@@ -2,29 +2,53 @@ import datetime as dt
 import os
 import sys
 import subprocess
+import tempfile
 
 from argparse import ArgumentParser
 
+from timeflow import binlog
+from timeflow import cache as result_cache
+from timeflow import compact as log_compact
+from timeflow import debug as debugging
+from timeflow import query as stats_query
+from timeflow import search as text_search
+from timeflow import server as query_server
+from timeflow import snapshot as log_snapshot
+from timeflow import sort as log_sort
 from timeflow import stats as statistics
+from timeflow import sync as log_sync
 from timeflow import utils
+from timeflow import watch as stats_watch
 
 
 def log(args):
-    utils.write_to_log_file(args.message)
+    if binlog.is_binary_log(utils.LOG_FILE):
+        last_minutes = binlog.get_last_minutes(utils.LOG_FILE)
+        now = dt.datetime.now()
+        new_day = (last_minutes is not None and
+                   utils.epoch_minutes_to_datetime(last_minutes).date() !=
+                   now.date())
+        line = ': '.join((now.strftime(utils.DATETIME_FORMAT), args.message))
+        try:
+            binlog.append_line(utils.LOG_FILE, line, new_day=new_day)
+        except ValueError as e:
+            sys.exit(str(e))
+    else:
+        utils.write_to_log_file(args.message)
 
 
 def _call_editor(editor, filename):
     editor = editor.split()
-    subprocess.call(editor + [utils.LOG_FILE])
+    subprocess.call(editor + [filename])
 
 
-def edit(args):
+def _edit_file(args, filename):
     if args.editor:
-        _call_editor(args.editor, utils.LOG_FILE)
+        _call_editor(args.editor, filename)
     else:
         subprocess.call(['echo', 'Trying to open $EDITOR'])
         if os.environ.get('EDITOR'):
-            _call_editor(os.environ.get('EDITOR'), utils.LOG_FILE)
+            _call_editor(os.environ.get('EDITOR'), filename)
         else:
             subprocess.call([
                 "echo",
@@ -34,13 +58,43 @@ def edit(args):
             ])
 
 
-def stats(args):
+def edit(args):
+    if not binlog.is_binary_log(utils.LOG_FILE):
+        _edit_file(args, utils.LOG_FILE)
+        return
+
+    # binary log is edited as text and imported back, if it was not
+    # appended to meanwhile
+    stat = os.stat(utils.LOG_FILE)
+    fd, tmp_file = tempfile.mkstemp(prefix='timeflow-', suffix='.txt')
+    with os.fdopen(fd, 'w') as fp:
+        fp.writelines(binlog.iter_text_lines(utils.LOG_FILE))
+    _edit_file(args, tmp_file)
+    with open(tmp_file, 'r') as fp:
+        try:
+            binlog.write_binary_log(utils.LOG_FILE, fp.readlines(), stat)
+        except ValueError as e:
+            # edited text is kept, so changes are not lost
+            sys.exit("{}, edited log is kept in {}".format(e, tmp_file))
+    os.remove(tmp_file)
+
+
+def require_text_log(command):
+    if binlog.is_binary_log(utils.LOG_FILE):
+        sys.exit("`{}` works only with text log, "
+                 "convert binary log to text with `export-text`"
+                 .format(command))
+
+
+def get_date_range(args):
+    """
+    Returns date range selected by arguments, whether it's the default
+    today's range, and literal and email time range names
+    """
     today = False
     date_from = date_to = None
     email_time_range = None
     literal_time_range = ''
-    filter_projects = []
-    exclude_projects = []
     if args.yesterday:
         yesterday_obj = dt.datetime.now() - dt.timedelta(days=1)
         date_from = date_to = yesterday_obj.strftime(utils.DATE_FORMAT)
@@ -83,40 +137,367 @@ def stats(args):
         date_from = date_to = dt.datetime.now().strftime(utils.DATE_FORMAT)
         email_time_range = "day"
         today = True
+    return date_from, date_to, today, literal_time_range, email_time_range
+
 
+def get_project_filters(args):
+    filter_projects = []
+    exclude_projects = []
     if args.filter_projects:
         filter_projects = [str(item) for item in args.filter_projects.split(',')]
     if args.exclude_projects:
         exclude_projects = [str(item) for item in args.exclude_projects.split(',')]
+    return filter_projects, exclude_projects
+
+
+def get_where(args):
+    "Returns compiled `--where` query, or None if it's not passed"
+    if not args.where:
+        return None
+    try:
+        return stats_query.Query(args.where)
+    except ValueError as e:
+        sys.exit("Invalid query: {}".format(e))
+
+
+def stats(args):
+    (date_from, date_to, today,
+     literal_time_range, email_time_range) = get_date_range(args)
+    filter_projects, exclude_projects = get_project_filters(args)
+    where = get_where(args)
+    if args.format and not args.rolling:
+        sys.exit("Output format can be set only for rolling stats")
+
+    if args.watch:
+        if (args.report or args.report_as_gtimelog or args.range or
+                args.compare or args.rolling):
+            sys.exit("Only stats totals can be watched")
+        try:
+            stats_watch.watch_stats(date_from, date_to,
+                                    filter_projects, exclude_projects,
+                                    today=today, where=where)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.rolling:
+        stats_rolling(args, date_from, date_to,
+                      filter_projects, exclude_projects, where)
+        return
+
+    if args.range or args.compare:
+        # explicitly passed ranges replace default today's range
+        ranges = [] if today and args.range else [(date_from, date_to)]
+        ranges += [utils.parse_range_arg(arg) for arg in args.range or []]
+        ranges += [utils.NAMED_RANGES[name]() for name in args.compare or []]
+        stats_ranges(args, ranges, filter_projects, exclude_projects, where)
+        return
+
+    if args.report:
+        output_format = "report"
+    elif args.report_as_gtimelog:
+        output_format = "gtimelog:{}".format(literal_time_range)
+    else:
+        output_format = "stats"
+
+    # today's stats change every minute, so they are not cached
+    cache_key = None
+    if not (today or args.no_cache):
+        cache_key = result_cache.get_key(date_from, date_to,
+                                         filter_projects, exclude_projects,
+                                         output_format, args.where)
 
+    output = result_cache.load(cache_key) if cache_key else None
+    if output is None:
+        output = create_stats_output(args, date_from, date_to, today,
+                                     literal_time_range,
+                                     filter_projects, exclude_projects, where)
+        if cache_key:
+            result_cache.save(cache_key, output)
+
+    print(output)
+
+    if args.email and (args.report or args.report_as_gtimelog):
+        statistics.email_report(date_from, date_to, output,
+                                email_time_range=email_time_range)
+
+
+def stats_ranges(args, ranges, filter_projects, exclude_projects,
+                 where=None):
     if args.report or args.report_as_gtimelog:
-        work_report, slack_report = statistics.calculate_report(
-            utils.read_log_file_lines(),
+        sys.exit("Reports can not be made for several date ranges")
+
+    ranges_stats = statistics.calculate_ranges_stats(
+        log_snapshot.update_snapshot(),
+        ranges,
+        filter_projects=filter_projects,
+        exclude_projects=exclude_projects,
+        where=where,
+    )
+    print(statistics.create_ranges_output(ranges, ranges_stats))
+
+
+def stats_rolling(args, date_from, date_to, filter_projects, exclude_projects,
+                  where=None):
+    if args.report or args.report_as_gtimelog or args.range or args.compare:
+        sys.exit("Rolling stats can be shown only for one date range")
+    if min(args.rolling) < 1:
+        sys.exit("Rolling window must be at least 1 day")
+
+    rolling_stats = statistics.calculate_rolling_stats(
+        log_snapshot.update_snapshot(),
+        date_from,
+        date_to,
+        args.rolling,
+        filter_projects=filter_projects,
+        exclude_projects=exclude_projects,
+        where=where,
+    )
+    print(statistics.create_rolling_output(
+        args.rolling, rolling_stats, output_format=args.format or "text"
+    ))
+
+
+def read_range_entries(date_from, date_to):
+    "Returns entries of the log, which has entries of the date range"
+    if binlog.is_binary_log(utils.LOG_FILE):
+        # records of the range are bisected right in binary log
+        return binlog.read_date_range_entries(utils.LOG_FILE,
+                                              date_from, date_to)
+    return log_snapshot.update_snapshot()
+
+
+def create_stats_output(args, date_from, date_to, today, literal_time_range,
+                        filter_projects, exclude_projects, where=None):
+    entries = read_range_entries(date_from, date_to)
+    if args.report or args.report_as_gtimelog:
+        work_records, slack_records = statistics.calculate_entries_report_records(
+            entries,
             date_from,
             date_to,
             filter_projects=filter_projects,
             exclude_projects=exclude_projects,
+            where=where,
         )
         if args.report:
-            output = statistics.create_full_report(work_report, slack_report)
-        elif args.report_as_gtimelog:
-            output = statistics.create_report_as_gtimelog(
-                work_report,
-                literal_time_range=literal_time_range,
-            )
-
-        print(output)
-
-        if args.email:
-            statistics.email_report(date_from, date_to, output,
-                                    email_time_range=email_time_range)
-
-    # do not print current working time if it's a report
-    if not any((args.report, args.report_as_gtimelog)):
-        work_time, slack_time, today_work_time = statistics.calculate_stats(
-            utils.read_log_file_lines(), date_from, date_to, today=today
+            return statistics.create_full_records_report(work_records,
+                                                         slack_records)
+        return statistics.create_records_report_as_gtimelog(
+            work_records,
+            literal_time_range=literal_time_range,
         )
-        print(statistics.get_total_stats_times(work_time, slack_time, today_work_time))
+
+    work_time, slack_time, today_work_time = statistics.calculate_entries_stats(
+        entries, date_from, date_to, today=today,
+        filter_projects=filter_projects,
+        exclude_projects=exclude_projects,
+        where=where,
+    )
+    return statistics.get_total_stats_times(work_time, slack_time,
+                                            today_work_time)
+
+
+def debug_memory(args):
+    (date_from, date_to, today,
+     literal_time_range, _) = get_date_range(args)
+    filter_projects, exclude_projects = get_project_filters(args)
+    where = get_where(args)
+
+    def query():
+        # parsed entries are returned too, so they are still allocated,
+        # when allocation sites are looked at
+        entries = log_snapshot.update_snapshot()
+        output = create_stats_output(args, date_from, date_to, today,
+                                     literal_time_range,
+                                     filter_projects, exclude_projects, where)
+        return entries, output
+
+    _, peak, snapshot = debugging.trace_memory(query)
+    print(debugging.create_memory_output(peak, snapshot, limit=args.limit))
+
+
+def cache(args):
+    if args.action == "clear":
+        result_cache.clear()
+        print("Cache cleared")
+    else:
+        counters = result_cache.get_counters()
+        print("Hits: {}\nMisses: {}".format(counters["hits"],
+                                             counters["misses"]))
+
+
+def top(args):
+    date_from, date_to, _, _, _ = get_date_range(args)
+    filter_projects, exclude_projects = get_project_filters(args)
+    work_top, slack_top = statistics.calculate_top(
+        log_snapshot.update_snapshot(),
+        date_from,
+        date_to,
+        args.k,
+        by=args.by,
+        filter_projects=filter_projects,
+        exclude_projects=exclude_projects,
+        where=get_where(args),
+    )
+    print(statistics.create_top_output(work_top, slack_top))
+
+
+def search(args):
+    require_text_log("search")
+    results = text_search.search(args.terms, args._from, args.to)
+    work_time = [seconds for _, seconds, is_slack in results if not is_slack]
+    slack_time = [seconds for _, seconds, is_slack in results if is_slack]
+
+    output = text_search.create_search_output(results)
+    if output:
+        output += "\n"
+    output += statistics.get_total_stats_times(work_time, slack_time, None)
+    print(output)
+
+
+def sort(args):
+    require_text_log("sort")
+    for filename in args.merge:
+        if not os.path.isfile(filename):
+            sys.exit("Log file to merge {} doesn't exist".format(filename))
+    try:
+        entries, duplicates = log_sort.sort_log(args.merge)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("Sorted {} entries, dropped {} duplicates".format(entries,
+                                                          duplicates))
+
+
+def compact(args):
+    require_text_log("compact")
+    try:
+        lines, size = log_compact.compact_log(args.before)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("Removed {} lines, saved {} bytes".format(lines, size))
+
+
+def export_text(args):
+    if not binlog.is_binary_log(utils.LOG_FILE):
+        sys.exit("Log is not binary, it's already text")
+    lines = binlog.iter_text_lines(utils.LOG_FILE)
+    if args.file:
+        with open(args.file, 'w') as fp:
+            fp.writelines(lines)
+    else:
+        sys.stdout.writelines(lines)
+
+
+def import_text(args):
+    if not args.file and binlog.is_binary_log(utils.LOG_FILE):
+        sys.exit("Log is already binary, pass text log file to import")
+    with open(args.file or utils.LOG_FILE, 'r') as fp:
+        try:
+            entries = binlog.write_binary_log(utils.LOG_FILE, fp.readlines())
+        except ValueError as e:
+            sys.exit(str(e))
+    print("Imported {} entries into binary log".format(entries))
+
+
+def sync(args):
+    require_text_log("sync")
+    if binlog.is_binary_log(log_sync.get_other_log_file(args.other_path)):
+        sys.exit("`sync` works only with text logs, other log is binary")
+    try:
+        days, added_lines, other_added_lines = log_sync.sync_log(
+            args.other_path
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+    if not days:
+        print("Logs are in sync")
+        return
+    print("Merged {} days, added {} lines to the log and {} lines to the "
+          "other log".format(days, added_lines, other_added_lines))
+
+
+def serve(args):
+    server = query_server.create_server(args.host, args.port)
+    print("Serving log queries on http://{}:{}/".format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def add_date_range_arguments(parser):
+    parser.add_argument(
+        "--today",
+        action="store_true",
+        help="Show today's work times (default)"
+    )
+    parser.add_argument(
+        "-y", "--yesterday",
+        action="store_true",
+        help="Show yesterday's work times"
+    )
+    parser.add_argument(
+        "-d", "--day",
+        help="Show specific day's work times"
+    )
+    parser.add_argument(
+        "--week",
+        help="Show specific week's work times"
+    )
+    parser.add_argument(
+        "--this-week",
+        action="store_true",
+        help="Show current week's work times"
+    )
+    parser.add_argument(
+        "--last-week",
+        action="store_true",
+        help="Show last week's work times"
+    )
+    parser.add_argument(
+        "--month",
+        help="Show specific month's work times"
+    )
+    parser.add_argument(
+        "--this-month",
+        action="store_true",
+        help="Show current month's work times"
+    )
+    parser.add_argument(
+        "--last-month",
+        action="store_true",
+        help="Show last month's work times"
+    )
+    parser.add_argument(
+        "-f", "--from",
+        help="Show work times from specific date",
+        dest="_from"
+    )
+    parser.add_argument(
+        "-t", "--to",
+        help="Show work times from to specific date"
+    )
+
+
+def add_project_filter_arguments(parser):
+    parser.add_argument(
+        "--filter-projects",
+        nargs="?",
+        help="Filter list of projects included in stats or report"
+    )
+    parser.add_argument(
+        "--exclude-projects",
+        nargs="?",
+        help="Exclude list of projects from stats or report"
+    )
+    parser.add_argument(
+        "--where",
+        metavar="QUERY",
+        help="Count only entries matching query, e.g. "
+             "'log ~ \"ABC-\\d+\" and weekday in (sat, sun)'"
+    )
 
 
 def create_parser():
@@ -147,83 +528,226 @@ def create_parser():
         "stats",
         help="Show how much time was spent working or slacking"
     )
+    add_date_range_arguments(stats_parser)
     stats_parser.add_argument(
-        "--today",
-        action="store_true",
-        help="Show today's work times (default)"
+        "--range",
+        action="append",
+        metavar="FROM:TO",
+        help="Show work times of date range side by side with other ranges"
     )
     stats_parser.add_argument(
-        "-y", "--yesterday",
-        action="store_true",
-        help="Show yesterday's work times"
+        "--compare",
+        action="append",
+        choices=sorted(utils.NAMED_RANGES),
+        help="Compare work times with other named date range"
     )
     stats_parser.add_argument(
-        "-d", "--day",
-        help="Show specific day's work times"
+        "--rolling",
+        action="append",
+        type=int,
+        metavar="N",
+        help="Show work times of every day summed up over the last N days, "
+             "can be used several times"
     )
     stats_parser.add_argument(
-        "--week",
-        help="Show specific week's work times"
+        "--format",
+        choices=["text", "csv", "json"],
+        help="Output format of rolling work times, only with --rolling "
+             "(default: text)"
     )
     stats_parser.add_argument(
-        "--this-week",
+        "-r", "--report",
         action="store_true",
-        help="Show current week's work times"
+        help="Show stats in report form"
     )
     stats_parser.add_argument(
-        "--last-week",
+        "--report-as-gtimelog",
         action="store_true",
-        help="Show last week's work times"
+        help="Show stats in gtimelog report form"
     )
     stats_parser.add_argument(
-        "--month",
-        help="Show specific month's work times"
+        "--email",
+        action="store_true",
+        help="Send generated report to activity email"
     )
+    add_project_filter_arguments(stats_parser)
     stats_parser.add_argument(
-        "--this-month",
+        "-w", "--watch",
         action="store_true",
-        help="Show current month's work times"
+        help="Keep showing stats, update them when log changes"
     )
     stats_parser.add_argument(
-        "--last-month",
+        "--no-cache",
         action="store_true",
-        help="Show last month's work times"
+        help="Do not use cached results, nor cache new ones"
     )
-    stats_parser.add_argument(
+    stats_parser.set_defaults(func=stats)
+
+    # `top` command
+    top_parser = subparser.add_parser(
+        "top",
+        help="Show projects or logs, which took most of the time"
+    )
+    top_parser.add_argument(
+        "--by",
+        choices=["project", "log"],
+        default="project",
+        help="Rank projects (default) or logs of the projects"
+    )
+    top_parser.add_argument(
+        "-k",
+        type=int,
+        default=10,
+        help="Number of projects or logs to show (default: 10)"
+    )
+    add_date_range_arguments(top_parser)
+    add_project_filter_arguments(top_parser)
+    top_parser.set_defaults(func=top)
+
+    # `search` command
+    search_parser = subparser.add_parser(
+        "search",
+        help="Search log entries by words in their project or log message"
+    )
+    search_parser.add_argument(
+        "terms",
+        nargs="+",
+        help="Words, which must be found in the entry"
+    )
+    search_parser.add_argument(
         "-f", "--from",
-        help="Show work times from specific date",
+        help="Search entries from specific date",
         dest="_from"
     )
-    stats_parser.add_argument(
+    search_parser.add_argument(
         "-t", "--to",
-        help="Show work times from to specific date"
+        help="Search entries up to specific date"
     )
-    stats_parser.add_argument(
+    search_parser.set_defaults(func=search)
+
+    # `sort` command
+    sort_parser = subparser.add_parser(
+        "sort",
+        help="Sort log entries chronologically, merging in other logs"
+    )
+    sort_parser.add_argument(
+        "-m", "--merge",
+        nargs="+",
+        default=[],
+        metavar="FILE",
+        help="Merge entries of other log files into the log"
+    )
+    sort_parser.set_defaults(func=sort)
+
+    # `compact` command
+    compact_parser = subparser.add_parser(
+        "compact",
+        help="Merge runs of entries with the same project and log"
+    )
+    compact_parser.add_argument(
+        "--before",
+        metavar="DATE",
+        help="Compact only entries before specific date"
+    )
+    compact_parser.set_defaults(func=compact)
+
+    # `sync` command
+    sync_parser = subparser.add_parser(
+        "sync",
+        help="Merge days, which differ, with other log, e.g. on other machine"
+    )
+    sync_parser.add_argument(
+        "other_path",
+        metavar="OTHER_PATH",
+        help="Other log file, or directory with log file of the same name"
+    )
+    sync_parser.set_defaults(func=sync)
+
+    # `export-text` command
+    export_parser = subparser.add_parser(
+        "export-text",
+        help="Write binary log as text log"
+    )
+    export_parser.add_argument(
+        "file",
+        nargs="?",
+        help="Text log file to write, standard output by default"
+    )
+    export_parser.set_defaults(func=export_text)
+
+    # `import-text` command
+    import_parser = subparser.add_parser(
+        "import-text",
+        help="Replace log with binary log of the text log"
+    )
+    import_parser.add_argument(
+        "file",
+        nargs="?",
+        help="Text log file to import, the log itself by default"
+    )
+    import_parser.set_defaults(func=import_text)
+
+    # `serve` command
+    serve_parser = subparser.add_parser(
+        "serve",
+        help="Serve stats, reports and entries as JSON over HTTP"
+    )
+    serve_parser.add_argument(
+        "-p", "--port",
+        type=int,
+        default=8000,
+        help="Port to listen on (default: 8000)"
+    )
+    serve_parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1)"
+    )
+    serve_parser.set_defaults(func=serve)
+
+    # `debug` command
+    debug_parser = subparser.add_parser(
+        "debug",
+        help="Diagnose resource usage of the stats queries"
+    )
+    debug_subparser = debug_parser.add_subparsers()
+    memory_parser = debug_subparser.add_parser(
+        "memory",
+        help="Show peak memory and top allocation sites of stats query"
+    )
+    add_date_range_arguments(memory_parser)
+    memory_parser.add_argument(
         "-r", "--report",
         action="store_true",
-        help="Show stats in report form"
+        help="Query stats in report form"
     )
-    stats_parser.add_argument(
+    memory_parser.add_argument(
         "--report-as-gtimelog",
         action="store_true",
-        help="Show stats in gtimelog report form"
+        help="Query stats in gtimelog report form"
     )
-    stats_parser.add_argument(
-        "--email",
-        action="store_true",
-        help="Send generated report to activity email"
+    add_project_filter_arguments(memory_parser)
+    memory_parser.add_argument(
+        "-n", "--limit",
+        type=int,
+        default=10,
+        help="Number of allocation sites to show (default: 10)"
     )
-    stats_parser.add_argument(
-        "--filter-projects",
-        nargs="?",
-        help="Filter list of projects included in report"
+    memory_parser.set_defaults(func=debug_memory)
+
+    # `cache` command
+    cache_parser = subparser.add_parser(
+        "cache",
+        help="Show cache hit/miss counters or clear cached stats"
     )
-    stats_parser.add_argument(
-        "--exclude-projects",
+    cache_parser.add_argument(
+        "action",
+        choices=["stats", "clear"],
         nargs="?",
-        help="Exclude list of projects from report"
+        default="stats",
+        help="Show counters (default) or clear the cache"
     )
-    stats_parser.set_defaults(func=stats)
+    cache_parser.set_defaults(func=cache)
 
     # pass every argument to parser, except the program name
     return parser
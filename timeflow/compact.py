@@ -0,0 +1,106 @@
+import os
+
+from timeflow import utils
+from timeflow.stats import calculate_report
+from timeflow.stats import calculate_stats
+from timeflow.utils import DATE_LEN
+from timeflow.utils import parse_line
+
+
+def _entry_key(line):
+    entry = parse_line(line)
+    return entry.project, entry.log, entry.is_slack
+
+
+def compact_lines(lines):
+    """
+    Returns lines of a day without redundant entries
+
+    Entry is redundant if the next entry has the same project, log and slack
+    mark: time of both is counted from the entry before them, so keeping
+    only the last one gives the same totals. The first entry of the day is
+    always kept, as day's time is counted from it.
+    """
+    compacted = []
+    previous_key = None
+    for i, line in enumerate(lines):
+        key = _entry_key(line)
+        if i > 1 and key == previous_key:
+            # the last entry of the run replaces the previous ones
+            compacted[-1] = line
+        else:
+            compacted.append(line)
+        previous_key = key
+    return compacted
+
+
+def _get_results(lines):
+    date = lines[0][:DATE_LEN]
+    work_time, slack_time, _ = calculate_stats(lines, date, date)
+    work_report, slack_report = calculate_report(lines, date, date)
+    # order of logs matters, as reports are shown in it
+    return (
+        sum(work_time), sum(slack_time),
+        [(project, list(logs.items())) for project, logs in work_report.items()],
+        [(project, list(logs.items())) for project, logs in slack_report.items()],
+    )
+
+
+def compact_day(lines):
+    """
+    Returns compacted lines of a day, if they give the same stats and
+    report as the original lines, otherwise returns the original lines
+    """
+    try:
+        compacted = compact_lines(lines)
+    except ValueError:
+        # malformed lines are left for the user to fix
+        return lines
+    if len(compacted) == len(lines):
+        return lines
+    if _get_results(compacted) != _get_results(lines):
+        return lines
+    return compacted
+
+
+def _iter_days(fp):
+    """
+    Yields lists of consecutive lines of the same date, and empty lines
+    as they are
+    """
+    day = []
+    for line in fp:
+        if day and (line == '\n' or line[:DATE_LEN] != day[0][:DATE_LEN]):
+            yield day
+            day = []
+        if line == '\n':
+            yield [line]
+        else:
+            day.append(line)
+    if day:
+        yield day
+
+
+def compact_log(before=None):
+    """
+    Removes redundant entries of the days before `before` date, or of all
+    days, and rewrites log file with `utils.rewrite_file`
+
+    Log file is read day by day, so only one day is kept in memory. Every
+    compacted day is checked to give the same stats and report, days which
+    don't are kept as they are.
+
+    Returns number of lines and bytes removed.
+    """
+    removed_lines = 0
+    with utils.rewrite_file(utils.LOG_FILE) as tmp_file:
+        size = os.path.getsize(utils.LOG_FILE)
+        with open(utils.LOG_FILE, 'r') as src, open(tmp_file, 'w') as dst:
+            for lines in _iter_days(src):
+                if lines[0] != '\n' and (not before or
+                                         lines[0][:DATE_LEN] < before):
+                    compacted = compact_day(lines)
+                    removed_lines += len(lines) - len(compacted)
+                    lines = compacted
+                dst.writelines(lines)
+    return removed_lines, size - os.path.getsize(utils.LOG_FILE)
@@ -0,0 +1,45 @@
+import tracemalloc
+
+from timeflow.utils import format_size
+
+
+def trace_memory(func, *args, **kwargs):
+    """
+    Calls `func` while tracing memory allocations
+
+    Returns result of the call, peak size of traced memory in bytes, and
+    tracemalloc snapshot of the memory allocated by the call, which was not
+    yet freed, when the call returned.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    # tracing is started again, as it's the only way to reset the peak
+    # before Python 3.9
+    if was_tracing:
+        tracemalloc.stop()
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        if was_tracing:
+            tracemalloc.start()
+    return result, peak, snapshot
+
+
+def create_memory_output(peak, snapshot, limit=10):
+    "Returns peak memory and top allocation sites of the snapshot"
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    output = "Peak memory: {}\n".format(format_size(peak))
+    output += "Top allocation sites:\n"
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        output += "    {:>10s}  {:8d} blocks  {}:{}\n".format(
+            format_size(stat.size), stat.count,
+            frame.filename, frame.lineno,
+        )
+    return output.rstrip('\n')
@@ -0,0 +1,263 @@
+import array
+import bisect
+import hashlib
+
+from timeflow.utils import Line
+from timeflow.utils import DATE_FORMAT
+from timeflow.utils import MINUTES_IN_DAY
+from timeflow.utils import TIME_FORMAT
+from timeflow.utils import get_epoch_days
+from timeflow.utils import epoch_minutes_to_datetime
+from timeflow.utils import get_file_state
+from timeflow.utils import is_appended
+from timeflow.views import EntryView
+from timeflow.views import iter_line_bounds
+
+# typecodes of the columns, all of them are fixed width
+COLUMNS = (
+    ('offsets', 'Q'),
+    ('minutes', 'i'),
+    ('projects', 'I'),
+    ('logs', 'I'),
+    ('slack', 'B'),
+)
+
+
+class Entries():
+    """
+    Columnar representation of the log file entries
+
+    Every entry (non empty log line) is a row of fixed width columns:
+    `offsets` - byte offset of the line in the log file,
+    `minutes` - time of the entry in minutes since epoch,
+    `projects` and `logs` - ids of the project and log strings, which are
+    kept in `project_names` and `log_names` string tables,
+    `slack` - 1 if entry is marked as slack, 0 otherwise.
+
+    Columns are `array.array` or read only `memoryview` objects, e.g. over
+    memory mapped snapshot file. `size` is the number of log file bytes,
+    which were parsed into entries, and `log_hash` is SHA-1 digest of them,
+    which is chained with digests of appended bytes, see `chain_hash`.
+    `file_state` is `utils.get_file_state` of the log file, when it was
+    parsed.
+    """
+    def __init__(self, columns=None, project_names=None, log_names=None,
+                 size=0, partial=False, log_hash=None, file_state=None):
+        if columns is None:
+            columns = [array.array(typecode) for _, typecode in COLUMNS]
+        for (name, _), column in zip(COLUMNS, columns):
+            setattr(self, name, column)
+        self.project_names = project_names or []
+        self.log_names = log_names or []
+        self.size = size
+        # last line has no new line char at the end, so it may be incomplete
+        self.partial = partial
+        self.log_hash = log_hash
+        self.file_state = file_state
+        self._project_ids = None
+        self._log_ids = None
+        self._raw_project_ids = None
+        self._raw_log_ids = None
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def columns(self):
+        return [getattr(self, name) for name, _ in COLUMNS]
+
+    def copy(self):
+        "Returns copy of entries, which can be changed independently"
+        entries = Entries(
+            [_copy_column(column, typecode)
+             for column, (_, typecode) in zip(self.columns(), COLUMNS)],
+            list(self.project_names), list(self.log_names),
+            size=self.size, partial=self.partial, log_hash=self.log_hash,
+            file_state=self.file_state,
+        )
+        return entries
+
+    def _make_mutable(self):
+        "Copies read only columns into arrays, so entries can be appended"
+        for name, typecode in COLUMNS:
+            column = getattr(self, name)
+            if not isinstance(column, array.array):
+                setattr(self, name, _copy_column(column, typecode))
+        if self._project_ids is None:
+            self._project_ids = {
+                name: i for i, name in enumerate(self.project_names)
+            }
+            self._log_ids = {name: i for i, name in enumerate(self.log_names)}
+            # ids of raw project and log bytes, as they are in the log file
+            self._raw_project_ids = {}
+            self._raw_log_ids = {}
+
+    def _intern(self, ids, names, name):
+        string_id = ids.get(name)
+        if string_id is None:
+            string_id = ids[name] = len(names)
+            names.append(name)
+        return string_id
+
+    def append_data(self, data):
+        """
+        Parses log file bytes `data`, which follow already parsed `size`
+        bytes, and appends them as entries
+
+        Lines are parsed through `EntryView`, so project and log strings
+        are decoded and stripped only once for the same raw bytes.
+        """
+        self._make_mutable()
+        if self.partial:
+            # incomplete last line is parsed once again with the new data
+            for name, _ in COLUMNS:
+                getattr(self, name).pop()
+            self.partial = False
+
+        parsed = len(data)
+        view = EntryView(data)
+        for start, end, next_start in iter_line_bounds(data):
+            # the same view is moved over the lines, not to create new ones
+            view.move(start, end)
+            if next_start is None:
+                # incomplete last line is left to be parsed, when it's
+                # complete, if it's too short to be parsed now
+                parsed = start
+                try:
+                    self.append_view(view, self.size + start)
+                except ValueError:
+                    break
+                self.partial = True
+            else:
+                self.append_view(view, self.size + start)
+        self.size += parsed
+
+    def append_view(self, view, offset):
+        """
+        Appends entry of `EntryView` of a log line at `offset`
+
+        Raw project and log are looked up as memoryviews of the buffer, so
+        their bytes are copied only when they are seen first time.
+        """
+        minutes = view.minutes
+        project_view = view.project_view
+        project_id = self._raw_project_ids.get(project_view)
+        if project_id is None:
+            project_id = self._intern(self._project_ids, self.project_names,
+                                      view.project)
+            self._raw_project_ids[bytes(project_view)] = project_id
+        log_view = view.log_view
+        log_id = self._raw_log_ids.get(log_view)
+        if log_id is None:
+            log_id = self._intern(self._log_ids, self.log_names, view.log)
+            self._raw_log_ids[bytes(log_view)] = log_id
+        self.offsets.append(offset)
+        self.minutes.append(minutes)
+        self.projects.append(project_id)
+        self.logs.append(log_id)
+        self.slack.append(view.is_slack)
+
+    def append_entry(self, offset, minutes, project, log, is_slack):
+        "Appends entry, project and log are without slack marks"
+        if self._project_ids is None:
+            self._make_mutable()
+        self.offsets.append(offset)
+        self.minutes.append(minutes)
+        self.projects.append(self._intern(self._project_ids,
+                                          self.project_names, project))
+        self.logs.append(self._intern(self._log_ids, self.log_names, log))
+        self.slack.append(is_slack)
+
+    def line(self, i):
+        "Returns entry as `Line`, project and log are without slack marks"
+        time = epoch_minutes_to_datetime(self.minutes[i])
+        return Line(
+            time.strftime(DATE_FORMAT),
+            time.strftime(TIME_FORMAT),
+            self.project_names[self.projects[i]],
+            self.log_names[self.logs[i]],
+            bool(self.slack[i]),
+        )
+
+    def date_range(self, date_from, date_to):
+        """
+        Returns indexes of the first entry of `date_from` and of the entry
+        after the last one of `date_to`
+        """
+        begin = bisect.bisect_left(
+            self.minutes, get_epoch_days(date_from) * MINUTES_IN_DAY
+        )
+        end = bisect.bisect_left(
+            self.minutes, (get_epoch_days(date_to) + 1) * MINUTES_IN_DAY
+        )
+        return begin, max(begin, end)
+
+    def project_filter(self, filter_projects, exclude_projects):
+        """
+        Returns predicate on project ids, telling if project should be in
+        stats or report, or None if nothing has to be filtered
+
+        Works like `stats.project_filter`, but without comparing strings.
+        """
+        project_ids = {name: i for i, name in enumerate(self.project_names)}
+        filters = frozenset(project_ids[project]
+                            for project in filter_projects
+                            if project in project_ids)
+        excludes = frozenset(project_ids[project]
+                             for project in exclude_projects
+                             if project in project_ids)
+        if filter_projects:
+            return filters.__contains__
+        elif excludes:
+            return lambda project_id: project_id not in excludes
+        return None
+
+
+def _copy_column(column, typecode):
+    copied_column = array.array(typecode)
+    copied_column.frombytes(memoryview(column).cast('B'))
+    return copied_column
+
+
+def chain_hash(log_hash, data):
+    """
+    Returns SHA-1 digest of `data` bytes appended to the bytes, which digest
+    is `log_hash`
+
+    Digest of bytes, which are parsed at once, is their SHA-1 digest. Digest
+    of appended bytes is chained to the previous one, so appended bytes are
+    hashed only, even if the previous digest was stored, e.g. in snapshot.
+    """
+    if log_hash is not None and not data:
+        return log_hash
+    data_hash = hashlib.sha1(log_hash or b'')
+    data_hash.update(data)
+    return data_hash.digest()
+
+
+def read_entries(fp, entries=None):
+    """
+    Returns entries of log file opened in binary mode
+
+    If `entries` of the same log file are passed and the log file was only
+    appended to since they were parsed (see `utils.is_appended`), only bytes
+    appended since are parsed and added to `entries`. Otherwise the whole
+    log file is parsed.
+    """
+    if (entries is not None and entries.file_state is not None and
+            is_appended(fp, entries.file_state)):
+        parsed_size = entries.size
+        fp.seek(parsed_size)
+        data = fp.read()
+        entries.append_data(data)
+        entries.log_hash = chain_hash(entries.log_hash,
+                                      data[:entries.size - parsed_size])
+        entries.file_state = get_file_state(fp, entries.size)
+        return entries
+
+    fp.seek(0)
+    data = fp.read()
+    entries = Entries()
+    entries.append_data(data)
+    entries.log_hash = hashlib.sha1(data[:entries.size]).digest()
+    entries.file_state = get_file_state(fp, entries.size)
+    return entries
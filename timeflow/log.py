@@ -0,0 +1,123 @@
+import datetime as dt
+import os
+import threading
+
+from timeflow import snapshot
+from timeflow import utils
+from timeflow.binlog import read_log_entries
+from timeflow.stats import calculate_entries_report
+from timeflow.stats import calculate_entries_stats
+from timeflow.stats import iter_entry_times
+
+
+class Log():
+    """
+    Parsed log file, which can be queried many times without parsing it again
+
+    Log is parsed once, when it is created, and `refresh` parses only lines
+    appended since then. Queries can be run from several threads at once,
+    also while log is being refreshed: appended entries are added after
+    the ones being queried, which never change. If the last line was
+    incomplete, it's parsed again, so refreshed entries are copied and
+    replace the old ones only when they are complete.
+
+    >>> log = Log('~/.timeflow')
+    >>> work_time, slack_time, _ = log.stats('2015-01-01', '2015-01-31')
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = utils.LOG_FILE
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._stat = None
+        self._entries = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Parses lines appended to the log file since the last refresh
+
+        Whole log file is parsed again, if it was rewritten or edited in
+        place, see `utils.is_appended`. Returns True if log file has changed.
+        """
+        with self._lock:
+            with open(self.path, 'rb') as fp:
+                stat = os.fstat(fp.fileno())
+                if self._stat and (
+                        (self._stat.st_ino, self._stat.st_size,
+                         self._stat.st_mtime_ns) ==
+                        (stat.st_ino, stat.st_size, stat.st_mtime_ns)):
+                    return False
+
+                if self._entries is None:
+                    # warm start from the snapshot, if there is one
+                    entries = snapshot.update_snapshot(self.path)
+                else:
+                    entries = self._entries
+                    if entries.partial:
+                        # incomplete last entry, which may be queried, is
+                        # replaced, so it's changed in a copy
+                        entries = entries.copy()
+                    entries = read_log_entries(fp, entries)
+
+            self._entries = entries
+            self._stat = stat
+            return True
+
+    def fingerprint(self):
+        """
+        Returns string, which changes whenever entries of the log change
+
+        It's made of the size and the chained SHA-1 hash of the parsed log
+        file bytes, see `entries.chain_hash`.
+        """
+        entries = self._entries
+        return '{}-{}'.format(entries.size, entries.log_hash.hex())
+
+    def _get_range(self, date_from, date_to, now=None):
+        today = (now or dt.datetime.now()).strftime(utils.DATE_FORMAT)
+        return date_from or today, date_to or today
+
+    def stats(self, date_from=None, date_to=None,
+              filter_projects=(), exclude_projects=(), now=None):
+        """
+        Returns lists of work and slack times, and today's working time
+
+        Date range is today by default and `date_to` is today if only
+        `date_from` is given. Today is the date of `now`, which is current
+        time by default, and today's working time is calculated only for
+        today's stats, up to `now`.
+        """
+        today = date_from is None and date_to is None
+        date_from, date_to = self._get_range(date_from, date_to, now)
+        return calculate_entries_stats(
+            self._entries, date_from, date_to, today=today,
+            filter_projects=filter_projects,
+            exclude_projects=exclude_projects,
+            now=now,
+        )
+
+    def report(self, date_from=None, date_to=None,
+               filter_projects=(), exclude_projects=(), now=None):
+        """
+        Returns work and slack report dicts, like `stats.calculate_report`
+        """
+        date_from, date_to = self._get_range(date_from, date_to, now)
+        return calculate_entries_report(
+            self._entries, date_from, date_to,
+            filter_projects=filter_projects,
+            exclude_projects=exclude_projects,
+        )
+
+    def entries(self, date_from=None, date_to=None, now=None):
+        """
+        Returns list of (`Line`, seconds) tuples of entries in the date range
+
+        Seconds are time spent on the entry since the previous entry of the
+        same day, first entries of the days have None.
+        """
+        date_from, date_to = self._get_range(date_from, date_to, now)
+        entries = self._entries
+        begin, end = entries.date_range(date_from, date_to)
+        times = dict(iter_entry_times(entries, begin, end))
+        return [(entries.line(i), times.get(i)) for i in range(begin, end)]
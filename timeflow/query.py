@@ -0,0 +1,371 @@
+import operator
+import re
+
+from timeflow.utils import DATE_LEN
+from timeflow.utils import DATETIME_LEN
+from timeflow.utils import MINUTES_IN_DAY
+from timeflow.utils import get_epoch_days
+from timeflow.utils import get_epoch_minutes
+from timeflow.utils import get_project
+from timeflow.utils import parse_line
+from timeflow.utils import strip_log
+
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<operator>==|!=|<=|>=|[=<>~(),])
+      | (?P<word>[^\s"'=!<>~(),]+)
+    )
+''', re.VERBOSE)
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+# 1970-01-01, the first day since epoch, was thursday
+EPOCH_WEEKDAY = 3
+
+COMPARISONS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# fields of entry time, which are got from minutes since epoch
+TIME_FIELDS = {
+    'date': lambda minutes: minutes // MINUTES_IN_DAY,
+    'hour': lambda minutes: minutes % MINUTES_IN_DAY // 60,
+    'minute': lambda minutes: minutes % 60,
+    'weekday': lambda minutes: (minutes // MINUTES_IN_DAY +
+                                EPOCH_WEEKDAY) % 7,
+}
+STRING_FIELDS = ('project', 'log')
+OPERATORS = set(COMPARISONS) | {'~'}
+FIELDS = sorted(TIME_FIELDS) + sorted(STRING_FIELDS)
+
+# checks are done in order of their cost, so that time checks are done
+# first and message of log line is parsed only if they pass
+TIME_COST = 0
+SLACK_COST = 1
+STRING_COSTS = {'project': 2, 'log': 3}
+
+
+def tokenize(expression):
+    "Returns list of (<kind>, <value>) tokens of query expression"
+    tokens = []
+    position = 0
+    while expression[position:].strip():
+        match = TOKEN_RE.match(expression, position)
+        if match is None:
+            raise ValueError("Unexpected character at position {}: {}"
+                             .format(position + 1, expression[position:]))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            quote = value[0]
+            value = value[1:-1].replace('\\' + quote, quote)
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+def _parse_date(value):
+    try:
+        return get_epoch_days(value)
+    except ValueError:
+        raise ValueError("Date in form of YYYY-MM-DD is expected, not {!r}"
+                         .format(value))
+
+
+def _parse_number(maximum):
+    def parse(value):
+        if not value.isdigit() or int(value) > maximum:
+            raise ValueError("Number from 0 to {} is expected, not {!r}"
+                             .format(maximum, value))
+        return int(value)
+    return parse
+
+
+def _parse_weekday(value):
+    weekday = value.lower()[:3]
+    if weekday not in WEEKDAYS:
+        raise ValueError("Weekday like mon, tue or sun is expected, not {!r}"
+                         .format(value))
+    return WEEKDAYS.index(weekday)
+
+
+VALUE_PARSERS = {
+    'date': _parse_date,
+    'hour': _parse_number(23),
+    'minute': _parse_number(59),
+    'weekday': _parse_weekday,
+}
+
+
+def _compile_and(terms):
+    def compile_terms(source):
+        predicates = [compile_term(source)
+                      for _, compile_term in sorted(terms,
+                                                    key=lambda t: t[0])]
+
+        def predicate(entry):
+            for term_predicate in predicates:
+                if not term_predicate(entry):
+                    return False
+            return True
+        return predicate
+    return max(cost for cost, _ in terms), compile_terms
+
+
+def _compile_or(terms):
+    def compile_terms(source):
+        predicates = [compile_term(source)
+                      for _, compile_term in sorted(terms,
+                                                    key=lambda t: t[0])]
+
+        def predicate(entry):
+            for term_predicate in predicates:
+                if term_predicate(entry):
+                    return True
+            return False
+        return predicate
+    return max(cost for cost, _ in terms), compile_terms
+
+
+def _compile_not(term):
+    cost, compile_term = term
+
+    def compile_not(source):
+        term_predicate = compile_term(source)
+        return lambda entry: not term_predicate(entry)
+    return cost, compile_not
+
+
+def _compile_slack(is_slack):
+    def compile_slack(source):
+        get_slack = source.slack()
+        if is_slack:
+            return lambda entry: bool(get_slack(entry))
+        return lambda entry: not get_slack(entry)
+    return SLACK_COST, compile_slack
+
+
+def _compile_time(field, test):
+    get_field = TIME_FIELDS[field]
+
+    def compile_time(source):
+        get_minutes = source.minutes()
+        return lambda entry: test(get_field(get_minutes(entry)))
+    return TIME_COST, compile_time
+
+
+def _compile_string(field, test):
+    def compile_string(source):
+        return source.string_test(field, test)
+    return STRING_COSTS[field], compile_string
+
+
+class _Parser():
+    """
+    Recursive descent parser of query expression, which returns
+    (<cost>, <compile function>) term of it
+
+    Grammar of query expression:
+        expression := term ('or' term)*
+        term := factor ('and' factor)*
+        factor := 'not' factor | '(' expression ')' | 'slack' | 'work'
+                  | field operator value
+                  | field 'in' '(' value (',' value)* ')'
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def take(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("Query ends unexpectedly")
+        self.position += 1
+        return token
+
+    def take_keyword(self, keyword):
+        if self.peek() == ('word', keyword):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, value):
+        token = self.take()
+        if token[1] != value or token[0] == 'string':
+            raise ValueError("{!r} is expected, not {!r}".format(value,
+                                                                 token[1]))
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Query is empty")
+        term = self.parse_expression()
+        if self.position < len(self.tokens):
+            raise ValueError("Unexpected {!r}".format(self.peek()[1]))
+        return term
+
+    def parse_expression(self):
+        terms = [self.parse_term()]
+        while self.take_keyword('or'):
+            terms.append(self.parse_term())
+        return terms[0] if len(terms) == 1 else _compile_or(terms)
+
+    def parse_term(self):
+        factors = [self.parse_factor()]
+        while self.take_keyword('and'):
+            factors.append(self.parse_factor())
+        return factors[0] if len(factors) == 1 else _compile_and(factors)
+
+    def parse_factor(self):
+        if self.take_keyword('not'):
+            return _compile_not(self.parse_factor())
+        if self.peek() == ('operator', '('):
+            self.position += 1
+            term = self.parse_expression()
+            self.expect(')')
+            return term
+        if self.take_keyword('slack'):
+            return _compile_slack(True)
+        if self.take_keyword('work'):
+            return _compile_slack(False)
+        return self.parse_comparison()
+
+    def parse_values(self):
+        self.expect('(')
+        values = [self.parse_value()]
+        while self.peek() == ('operator', ','):
+            self.position += 1
+            values.append(self.parse_value())
+        self.expect(')')
+        return values
+
+    def parse_value(self):
+        kind, value = self.take()
+        if kind == 'operator':
+            raise ValueError("Value is expected, not {!r}".format(value))
+        return value
+
+    def parse_comparison(self):
+        kind, field = self.take()
+        if kind != 'word' or field not in FIELDS:
+            raise ValueError("Unknown field {!r}, expected one of: {}"
+                             .format(field, ', '.join(FIELDS)))
+        parse_value = VALUE_PARSERS.get(field, str)
+
+        if self.take_keyword('in'):
+            test = frozenset(parse_value(value)
+                             for value in self.parse_values()).__contains__
+        else:
+            kind, operator_name = self.take()
+            if kind != 'operator' or operator_name not in OPERATORS:
+                raise ValueError("Operator is expected after {!r}, not {!r}"
+                                 .format(field, operator_name))
+            value = self.parse_value()
+            if operator_name == '~':
+                if field not in STRING_FIELDS:
+                    raise ValueError("Only project and log can be matched "
+                                     "with regular expression")
+                try:
+                    test = re.compile(value).search
+                except re.error as e:
+                    raise ValueError("Invalid regular expression {!r}: {}"
+                                     .format(value, e))
+            else:
+                test = _comparison_test(COMPARISONS[operator_name],
+                                        parse_value(value))
+
+        if field in TIME_FIELDS:
+            return _compile_time(field, test)
+        return _compile_string(field, test)
+
+
+def _comparison_test(compare, value):
+    return lambda field_value: compare(field_value, value)
+
+
+def _line_minutes(line):
+    "Returns time of raw log line, reading only its fixed width time prefix"
+    return get_epoch_minutes(line[:DATE_LEN],
+                             line[DATE_LEN + 1:DATETIME_LEN])
+
+
+class _LinesSource():
+    "Gets fields of raw log lines, parsing messages only when needed"
+    def minutes(self):
+        return _line_minutes
+
+    def slack(self):
+        return lambda line: parse_line(line).is_slack
+
+    def string_test(self, field, test):
+        if field == 'project':
+            return lambda line: bool(test(get_project(line)))
+        return lambda line: bool(test(strip_log(parse_line(line).log)))
+
+
+class _EntriesSource():
+    """
+    Gets fields of entries by their indexes, strings are tested only once
+    per string id
+
+    Columns are looked up on every call, as read only columns are replaced
+    with arrays, when entries are appended.
+    """
+    def __init__(self, entries):
+        self.entries = entries
+
+    def minutes(self):
+        entries = self.entries
+        return lambda i: entries.minutes[i]
+
+    def slack(self):
+        entries = self.entries
+        return lambda i: entries.slack[i]
+
+    def string_test(self, field, test):
+        entries = self.entries
+        if field == 'project':
+            column, names = 'projects', entries.project_names
+        else:
+            column, names = 'logs', entries.log_names
+        results = {}
+
+        def predicate(i):
+            string_id = getattr(entries, column)[i]
+            result = results.get(string_id)
+            if result is None:
+                result = results[string_id] = bool(test(names[string_id]))
+            return result
+        return predicate
+
+
+class Query():
+    """
+    Query expression of `stats --where`, which is parsed once and compiled
+    into predicates of raw log lines or of entries
+
+    Expression compares fields of the entry, e.g.
+    `log ~ "ABC-\\d+" and weekday in (sat, sun) and hour >= 18 and slack`.
+    Raises ValueError if expression is not valid.
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        _, self._compile = _Parser(tokenize(expression)).parse()
+
+    def lines_predicate(self):
+        "Returns predicate of raw log lines"
+        return self._compile(_LinesSource())
+
+    def entries_predicate(self, entries):
+        "Returns predicate of indexes of `entries`"
+        return self._compile(_EntriesSource(entries))
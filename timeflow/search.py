@@ -0,0 +1,225 @@
+import mmap
+import os
+import re
+import sqlite3
+
+from contextlib import closing
+
+from timeflow import utils
+from timeflow.utils import DATE_LEN
+from timeflow.utils import DATETIME_LEN
+from timeflow.utils import calc_time_diff
+from timeflow.utils import format_duration_long
+from timeflow.utils import parse_line
+from timeflow.utils import parse_message
+from timeflow.utils import strip_log
+
+INDEX_VERSION = 2
+# words, which may be glued together by some punctuation, e.g. `ABC-123`
+TOKEN_RE = re.compile(r'\w+(?:[-./#]\w+)*')
+WORD_RE = re.compile(r'\w+')
+
+
+def get_index_file(log_file=None):
+    "Returns search index file path, which is unique for the log file"
+    return utils.get_cache_file(log_file or utils.LOG_FILE, '.index')
+
+
+def tokenize(text):
+    """
+    Returns set of lowercased tokens found in `text`
+
+    Compound tokens like `abc-123` are returned together with their parts,
+    so both `ABC-123` and `abc` searches would match them.
+    """
+    tokens = set()
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.add(token)
+        tokens.update(WORD_RE.findall(token))
+    return tokens
+
+
+def tokenize_line(line):
+    "Returns tokens of project and log of a log line"
+    message = line[DATETIME_LEN + 2:].rstrip('\n')
+    project, log = parse_message(message)
+    return tokenize(strip_log(project)) | tokenize(strip_log(log))
+
+
+def iter_postings(data, offset=0):
+    """
+    Yields (<token>, <line offset>) postings of lines of `data` bytes
+
+    `offset` is the position of `data` in the log file, so line offsets
+    always point to the beginning of the line in the log file.
+    """
+    for line in data.splitlines(True):
+        if line.strip():
+            for token in tokenize_line(line.decode('utf-8')):
+                yield token, offset
+        offset += len(line)
+
+
+def _index_data(index, fp, size):
+    """
+    Adds postings of complete lines of the log file after `size` bytes to
+    index, returns size of the indexed part of the log file
+
+    Incomplete last line is indexed, when it's complete.
+    """
+    fp.seek(size)
+    data = fp.read()
+    data = data[:data.rfind(b'\n') + 1]
+    index.executemany('INSERT INTO postings VALUES (?, ?)',
+                      iter_postings(data, offset=size))
+    return size + len(data)
+
+
+def _write_meta(index, fp, size):
+    meta = utils.get_file_state(fp, size)
+    meta['version'] = INDEX_VERSION
+    index.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                      sorted(meta.items()))
+
+
+def _read_meta(index):
+    try:
+        return dict(index.execute('SELECT key, value FROM meta'))
+    except sqlite3.DatabaseError:
+        return {}
+
+
+def _build_index(index_file, fp):
+    "Indexes the whole log file into a new index file, replacing the old one"
+    with utils.atomic_file(index_file) as tmp_file, \
+            closing(sqlite3.connect(tmp_file)) as index:
+        # new file is not used by anyone, until it replaces the old one
+        index.execute('PRAGMA journal_mode = OFF')
+        index.execute('PRAGMA synchronous = OFF')
+        index.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value)')
+        index.execute('CREATE TABLE postings (token TEXT, '
+                      'line_offset INTEGER, '
+                      'PRIMARY KEY (token, line_offset)) WITHOUT ROWID')
+        size = _index_data(index, fp, 0)
+        _write_meta(index, fp, size)
+        index.commit()
+
+
+def update_index():
+    """
+    Returns connection to the inverted index of the log file, which maps
+    tokens to entry offsets
+
+    Index is an SQLite database in cache directory, so postings of search
+    terms are looked up without loading the whole index. Only bytes
+    appended since the last update are indexed, see `utils.is_appended`,
+    otherwise (e.g. log was edited) the whole index is built again.
+    """
+    index_file = get_index_file()
+    with open(utils.LOG_FILE, 'rb') as fp:
+        stat = os.fstat(fp.fileno())
+        index = sqlite3.connect(index_file, isolation_level=None)
+        try:
+            # index is locked, so that the same lines are not indexed twice
+            index.execute('BEGIN IMMEDIATE')
+            meta = _read_meta(index)
+            if (meta.get('version') == INDEX_VERSION and
+                    utils.is_appended(fp, meta)):
+                if (meta['file_size'], meta['mtime']) != (stat.st_size,
+                                                          stat.st_mtime_ns):
+                    size = _index_data(index, fp, meta['size'])
+                    _write_meta(index, fp, size)
+                index.execute('COMMIT')
+                return index
+            index.execute('ROLLBACK')
+        except sqlite3.DatabaseError:
+            pass
+        index.close()
+        _build_index(index_file, fp)
+    return sqlite3.connect(index_file, isolation_level=None)
+
+
+def find_offsets(index, terms):
+    "Returns sorted offsets of entries, which contain every term"
+    query = set()
+    for term in terms:
+        query |= {match.group() for match in TOKEN_RE.finditer(term.lower())}
+    if not query:
+        return []
+
+    select = 'SELECT line_offset FROM postings WHERE token = ?'
+    sql = ' INTERSECT '.join([select] * len(query)) + ' ORDER BY line_offset'
+    return [offset for offset, in index.execute(sql, sorted(query))]
+
+
+def _previous_line_offset(data, offset):
+    "Returns offset of the previous non empty line, or None if there is none"
+    end = offset - 1
+    while end > 0 and data[end - 1:end] == b'\n':
+        end -= 1
+    if end <= 0:
+        return None
+    return data.rfind(b'\n', 0, end) + 1
+
+
+def _read_line(data, offset):
+    end = data.find(b'\n', offset)
+    if end == -1:
+        end = len(data)
+    return data[offset:end].decode('utf-8')
+
+
+def search(terms, date_from=None, date_to=None):
+    """
+    Returns log entries, which contain all `terms`, with their durations
+
+    Entries are returned as (line, seconds, is_slack) tuples. Durations are
+    computed in the same manner as in `calculate_report`: time is counted
+    from the previous entry of the same day, so the first entry of each day
+    has no duration and is not returned.
+    """
+    if not os.path.exists(utils.LOG_FILE):
+        return []
+    with closing(update_index()) as index:
+        offsets = find_offsets(index, terms)
+    if not offsets:
+        return []
+
+    results = []
+    with open(utils.LOG_FILE, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset in offsets:
+                date = data[offset:offset + DATE_LEN].decode('utf-8')
+                if date_from and date < date_from:
+                    continue
+                if date_to and date > date_to:
+                    continue
+
+                previous_offset = _previous_line_offset(data, offset)
+                if previous_offset is None:
+                    continue
+                previous_line = _read_line(data, previous_offset)
+                # first entry of the day has no duration
+                if previous_line[:DATE_LEN] != date:
+                    continue
+
+                line = parse_line(_read_line(data, offset))
+                time_diff = calc_time_diff(parse_line(previous_line), line)
+                results.append((line, time_diff, line.is_slack))
+    return results
+
+
+def create_search_output(results):
+    """
+    Returns string output for search results
+    """
+    output = ""
+    for line, seconds, is_slack in results:
+        message = line.project
+        if line.log:
+            message = "{}: {}".format(message, line.log)
+        output += "{} {}  {:14s}  {}\n".format(
+            line.date, line.time, format_duration_long(seconds), message
+        )
+    return output
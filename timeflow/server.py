@@ -0,0 +1,146 @@
+import datetime as dt
+import gzip
+import hashlib
+import json
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from timeflow import utils
+from timeflow.log import Log
+
+# responses bigger than this are gzipped, if client accepts it
+GZIP_MIN_SIZE = 1024
+
+
+def _split_arg(query, name):
+    "Returns list of comma separated values of query argument"
+    value = query.get(name, [''])[0]
+    return [item for item in value.split(',') if item]
+
+
+def get_stats(log, date_from, date_to, query, now):
+    work_time, slack_time, today_work_time = log.stats(
+        date_from, date_to,
+        filter_projects=_split_arg(query, 'filter_projects'),
+        exclude_projects=_split_arg(query, 'exclude_projects'),
+        now=now,
+    )
+    return {
+        'work_time': work_time,
+        'slack_time': slack_time,
+        'today_work_time': today_work_time,
+    }
+
+
+def get_report(log, date_from, date_to, query, now):
+    work_report, slack_report = log.report(
+        date_from, date_to,
+        filter_projects=_split_arg(query, 'filter_projects'),
+        exclude_projects=_split_arg(query, 'exclude_projects'),
+        now=now,
+    )
+    return {'work': work_report, 'slack': slack_report}
+
+
+def get_entries(log, date_from, date_to, query, now):
+    return [
+        {
+            'date': line.date,
+            'time': line.time,
+            'project': line.project,
+            'log': line.log,
+            'is_slack': line.is_slack,
+            'seconds': seconds,
+        }
+        for line, seconds in log.entries(date_from, date_to, now=now)
+    ]
+
+
+ENDPOINTS = {
+    '/stats': get_stats,
+    '/report': get_report,
+    '/entries': get_entries,
+}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers log queries with JSON
+
+    Query arguments are `from`, `to`, `filter_projects` and
+    `exclude_projects`, the last two are comma separated lists.
+    Responses have ETag, which depends on the log contents and the query
+    with its resolved date range, so unchanged results are answered with
+    304 without calculating them. Gzipped responses have their own ETag.
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = ENDPOINTS.get(url.path)
+        if endpoint is None:
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        date_from = query.get('from', [None])[0]
+        date_to = query.get('to', [None])[0]
+        # results for today depend on current time too
+        now = dt.datetime.now().replace(second=0, microsecond=0)
+        today = now.strftime(utils.DATE_FORMAT)
+        if date_from and not date_to:
+            date_to = today
+
+        log = self.server.log
+        log.refresh()
+        # tag depends on the resolved date range, as the same query means
+        # other days, when the date changes
+        tag = hashlib.sha1(json.dumps([
+            log.fingerprint(),
+            url.path,
+            date_from or today,
+            date_to or today,
+            _split_arg(query, 'filter_projects'),
+            _split_arg(query, 'exclude_projects'),
+            str(now) if not date_to else '',
+        ]).encode('utf-8')).hexdigest()
+        accepts_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        # gzipped body is other representation, so it has other tag
+        etags = {False: '"{}"'.format(tag), True: '"{}-gzip"'.format(tag)}
+
+        if_none_match = [etag.strip() for etag in
+                         self.headers.get('If-None-Match', '').split(',')]
+        for gzipped in (False, True) if accepts_gzip else (False,):
+            if etags[gzipped] in if_none_match:
+                self.send_response(304)
+                self.send_header('ETag', etags[gzipped])
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+
+        try:
+            result = endpoint(log, date_from, date_to, query, now)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        body = json.dumps(result).encode('utf-8')
+        gzipped = accepts_gzip and len(body) >= GZIP_MIN_SIZE
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etags[gzipped])
+        self.send_header('Vary', 'Accept-Encoding')
+        if gzipped:
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(host, port, log_file=None):
+    "Returns HTTP server, which answers queries of the log file"
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.log = Log(log_file)
+    return server
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from timeflow import utils
+from timeflow.entries import COLUMNS
+from timeflow.entries import Entries
+from timeflow.binlog import read_log_entries
+
+MAGIC = b'TFSNAP03'
+# magic, entries count, rows capacity of the columns, parsed log size, log
+# file size, log file mtime, log file inode, partial last line flag, string
+# table size, hash of parsed log bytes, hash of the check windows of them
+FIELDS = struct.Struct('<8sQQQQQQQQ20s20s')
+# fields are followed by their SHA-1 digest, so torn header is not used
+CHECKSUM_SIZE = 20
+# rows reserved in the columns at least, so new entries are written in place
+MIN_CAPACITY = 1024
+
+
+def get_snapshot_file(log_file):
+    "Returns snapshot file path, which is unique for the log file"
+    return utils.get_cache_file(log_file, '.snapshot')
+
+
+def _pad(size):
+    "Returns number of bytes to align `size` to 8 bytes"
+    return -size % 8
+
+
+HEADER_SIZE = (FIELDS.size + CHECKSUM_SIZE +
+               _pad(FIELDS.size + CHECKSUM_SIZE))
+
+
+def _pack_header(*fields):
+    header = FIELDS.pack(MAGIC, *fields)
+    return (header + hashlib.sha1(header).digest() +
+            b'\0' * (HEADER_SIZE - FIELDS.size - CHECKSUM_SIZE))
+
+
+def _unpack_header(buf):
+    "Returns header fields without magic, or None if header is not valid"
+    header = bytes(buf[:FIELDS.size])
+    checksum = bytes(buf[FIELDS.size:FIELDS.size + CHECKSUM_SIZE])
+    if (len(header) < FIELDS.size or header[:len(MAGIC)] != MAGIC or
+            hashlib.sha1(header).digest() != checksum):
+        return None
+    return FIELDS.unpack(header)[1:]
+
+
+def _get_layout(capacity):
+    "Returns offsets of the columns and of the string table in snapshot"
+    offsets = []
+    offset = HEADER_SIZE
+    for _, typecode in COLUMNS:
+        offsets.append(offset)
+        column_size = capacity * struct.calcsize(typecode)
+        offset += column_size + _pad(column_size)
+    return offsets, offset
+
+
+def _encode_strings(project_names, log_names):
+    "Returns string table lines of the project and log names"
+    lines = ([json.dumps(['project', name]) for name in project_names] +
+             [json.dumps(['log', name]) for name in log_names])
+    return ''.join(line + '\n' for line in lines).encode('utf-8')
+
+
+def _write_rows(fp, entries, offsets, start):
+    "Writes rows of entries from `start` into columns at `offsets`"
+    for offset, column, (_, typecode) in zip(offsets, entries.columns(),
+                                             COLUMNS):
+        fp.seek(offset + start * struct.calcsize(typecode))
+        fp.write(memoryview(column)[start:].tobytes())
+
+
+def _pack_entries_header(entries, capacity, strings_size):
+    state = entries.file_state
+    return _pack_header(
+        len(entries), capacity, entries.size, state['file_size'],
+        state['mtime'], state['inode'], entries.partial, strings_size,
+        entries.log_hash, bytes.fromhex(state['windows']),
+    )
+
+
+def write_snapshot(log_file, entries):
+    """
+    Writes entries into snapshot file atomically
+
+    Snapshot is a header followed by the columns, each of them aligned to
+    8 bytes, and by string table of JSON encoded lines. Columns have room
+    for more rows, than there are entries, so entries appended to the log
+    are written in place, see `append_snapshot`.
+    """
+    count = len(entries)
+    capacity = count + count // 4 + MIN_CAPACITY
+    offsets, strings_offset = _get_layout(capacity)
+    strings = _encode_strings(entries.project_names, entries.log_names)
+
+    with utils.atomic_file(get_snapshot_file(log_file)) as tmp_file, \
+            open(tmp_file, 'wb') as fp:
+        fp.write(_pack_entries_header(entries, capacity, len(strings)))
+        # space reserved for the new rows is left as a hole in the file
+        _write_rows(fp, entries, offsets, 0)
+        fp.seek(strings_offset)
+        fp.write(strings)
+
+
+def append_snapshot(log_file, entries, base):
+    """
+    Writes only entries and strings, which were appended to the snapshot
+    entries, into snapshot file in place, and then its header
+
+    `base` is (<entries count>, <parsed log size>, <log hash>, <projects
+    count>, <logs count>) of the snapshot entries before they were appended
+    to. New rows and strings are written after the ones, which header
+    refers to, so readers of the snapshot see them only with the new
+    header. Returns False if snapshot has no room for new rows, or it has
+    changed meanwhile, then it should be written anew.
+    """
+    count, size, log_hash, project_count, log_count = base
+    try:
+        with utils.locked_file(get_snapshot_file(log_file), 'r+b') as fp:
+            header = _unpack_header(fp.read(HEADER_SIZE))
+            if header is None:
+                return False
+            (snapshot_count, capacity, snapshot_size, _, _, _, partial,
+             strings_size, snapshot_hash, _) = header
+            if ((snapshot_count, snapshot_size, snapshot_hash, partial) !=
+                    (count, size, log_hash, False) or
+                    len(entries) > capacity):
+                return False
+
+            offsets, strings_offset = _get_layout(capacity)
+            _write_rows(fp, entries, offsets, count)
+            strings = _encode_strings(entries.project_names[project_count:],
+                                      entries.log_names[log_count:])
+            fp.seek(strings_offset + strings_size)
+            fp.write(strings)
+            fp.seek(0)
+            fp.write(_pack_entries_header(entries, capacity,
+                                          strings_size + len(strings)))
+    except IOError:
+        return False
+    return True
+
+
+def load_snapshot(log_file):
+    """
+    Returns entries, which columns are memory mapped from the snapshot file
+
+    Returns None if there is no valid snapshot.
+    """
+    try:
+        with open(get_snapshot_file(log_file), 'rb') as fp:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, ValueError):
+        return None
+    header = _unpack_header(buf)
+    if header is None:
+        return None
+    (count, capacity, size, file_size, mtime, inode, partial,
+     strings_size, log_hash, windows) = header
+
+    # columns are read without copying them out of the memory mapped file
+    offsets, strings_offset = _get_layout(capacity)
+    if len(buf) < strings_offset + strings_size:
+        return None
+    view = memoryview(buf)
+    columns = []
+    for offset, (_, typecode) in zip(offsets, COLUMNS):
+        column_size = count * struct.calcsize(typecode)
+        columns.append(view[offset:offset + column_size].cast(typecode))
+    names = {'project': [], 'log': []}
+    strings = bytes(view[strings_offset:strings_offset + strings_size])
+    for line in strings.splitlines():
+        kind, name = json.loads(line)
+        names[kind].append(name)
+
+    file_state = {
+        'inode': inode,
+        'file_size': file_size,
+        'mtime': mtime,
+        'size': size,
+        'windows': windows.hex(),
+    }
+    return Entries(columns, names['project'], names['log'],
+                   size=size, partial=bool(partial), log_hash=log_hash,
+                   file_state=file_state)
+
+
+def update_snapshot(log_file=None):
+    """
+    Returns entries of the log file, using and updating its snapshot
+
+    If log file has not changed, entries are memory mapped from the snapshot
+    as they are. If new lines were appended to the log file, only they are
+    parsed, see `utils.is_appended`, and only they are written into the
+    snapshot. Whole log file is parsed and snapshot is written anew only if
+    log was rewritten, e.g. edited, or the last line of it was incomplete.
+    """
+    if log_file is None:
+        log_file = utils.LOG_FILE
+    snapshot_entries = load_snapshot(log_file)
+    with open(log_file, 'rb') as fp:
+        base = None
+        if snapshot_entries is not None:
+            state = snapshot_entries.file_state
+            stat = os.fstat(fp.fileno())
+            if ((state['inode'], state['file_size'], state['mtime']) ==
+                    (stat.st_ino, stat.st_size, stat.st_mtime_ns)):
+                return snapshot_entries
+            base = (len(snapshot_entries), snapshot_entries.size,
+                    snapshot_entries.log_hash,
+                    len(snapshot_entries.project_names),
+                    len(snapshot_entries.log_names))
+
+        entries = read_log_entries(fp, snapshot_entries)
+        # entries are appended to in place, if only new lines were parsed
+        if (entries is not snapshot_entries or
+                not append_snapshot(log_file, entries, base)):
+            write_snapshot(log_file, entries)
+        return entries
@@ -0,0 +1,151 @@
+import contextlib
+import heapq
+import os
+import tempfile
+
+from timeflow import utils
+from timeflow.utils import DATE_LEN
+from timeflow.utils import DATETIME_LEN
+
+# number of lines, which are sorted in memory at once
+RUN_SIZE = 100000
+# number of runs, which are merged at once, not to run out of open files
+MERGE_FAN_IN = 64
+
+
+def _line_key(line):
+    return line[:DATETIME_LEN]
+
+
+def read_entries(filenames):
+    "Yields non empty lines of all files, each ending with new line char"
+    for filename in filenames:
+        with open(filename, 'r') as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                if line[-1] != '\n':
+                    line += '\n'
+                yield line
+
+
+def write_sorted_runs(lines, run_size, directory):
+    """
+    Splits lines into chunks of `run_size` lines, sorts every chunk in memory
+    and writes it to a run file in `directory`
+
+    Returns list of run file names and number of lines written. Run files
+    are closed, so that the number of runs is not limited by the number of
+    open files.
+    """
+    runs = []
+    chunk = []
+    lines_count = 0
+    for line in lines:
+        chunk.append(line)
+        lines_count += 1
+        if len(chunk) >= run_size:
+            runs.append(_write_run(chunk, directory))
+            chunk = []
+    if chunk or not runs:
+        runs.append(_write_run(chunk, directory))
+    return runs, lines_count
+
+
+def _write_run(chunk, directory):
+    # sort is stable, so entries of the same minute keep their order
+    chunk.sort(key=_line_key)
+    return _write_lines(chunk, directory)
+
+
+def _write_lines(lines, directory):
+    fd, filename = tempfile.mkstemp(suffix='.run', dir=directory)
+    with open(fd, 'w') as fp:
+        fp.writelines(lines)
+    return filename
+
+
+@contextlib.contextmanager
+def _open_runs(filenames):
+    "Opens run files and closes them, when they are merged"
+    with contextlib.ExitStack() as stack:
+        yield [stack.enter_context(open(filename, 'r'))
+               for filename in filenames]
+
+
+def merge_run_files(filenames, directory, fan_in=None):
+    """
+    Merges run files in passes of no more than `fan_in` files at once, until
+    there are no more than `fan_in` of them, returns names of the merged
+    run files
+
+    Merged runs are written to `directory`, runs they are merged from are
+    removed.
+    """
+    if fan_in is None:
+        fan_in = MERGE_FAN_IN
+    while len(filenames) > fan_in:
+        merged = []
+        for i in range(0, len(filenames), fan_in):
+            group = filenames[i:i + fan_in]
+            with _open_runs(group) as runs:
+                merged.append(_write_lines(merge_runs(runs), directory))
+            for filename in group:
+                os.remove(filename)
+        filenames = merged
+    return filenames
+
+
+def merge_runs(runs):
+    """
+    Yields lines of sorted runs in chronological order, without duplicates
+    """
+    # exact duplicates have the same time, so only lines of the current
+    # minute have to be remembered
+    minute = None
+    seen = set()
+    for line in heapq.merge(*runs, key=_line_key):
+        if _line_key(line) != minute:
+            minute = _line_key(line)
+            seen = set()
+        if line in seen:
+            continue
+        seen.add(line)
+        yield line
+
+
+def sort_log(merge_files=(), run_size=None):
+    """
+    Sorts log file entries chronologically, merging in entries from
+    `merge_files`, and rewrites log file with `utils.rewrite_file`
+
+    Sorting is done with external merge sort, so only `run_size` lines are
+    kept in memory at once and no more than `MERGE_FAN_IN` runs are open at
+    once. Runs are written into temporary directory next to the log file.
+    Exact duplicates are dropped and empty lines separating days are
+    rebuilt.
+
+    Returns number of entries written and number of duplicates dropped.
+    """
+    if run_size is None:
+        run_size = RUN_SIZE
+    filenames = [utils.LOG_FILE] + list(merge_files)
+    entries = 0
+    # runs are written next to the log file, as temporary directory may be
+    # in memory, e.g. tmpfs, which could not hold them
+    runs_dir = os.path.dirname(os.path.abspath(utils.LOG_FILE))
+    with utils.rewrite_file(utils.LOG_FILE) as tmp_file, \
+            tempfile.TemporaryDirectory(dir=runs_dir) as directory:
+        runs, lines_count = write_sorted_runs(read_entries(filenames),
+                                              run_size, directory)
+        runs = merge_run_files(runs, directory)
+        with _open_runs(runs) as run_files, open(tmp_file, 'w') as fp:
+            date = None
+            for line in merge_runs(run_files):
+                # we want easily seeable separation between the days
+                if date is not None and line[:DATE_LEN] != date:
+                    fp.write('\n')
+                date = line[:DATE_LEN]
+                fp.write(line)
+                entries += 1
+    return entries, lines_count - entries
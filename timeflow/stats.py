@@ -1,19 +1,31 @@
+import csv
 import datetime as dt
+import heapq
+import io
+import json
 import smtplib
 
 from collections import defaultdict
-from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
 
+from timeflow.aggregate import SpillingCounter
 from timeflow.settings import Settings
 from timeflow.utils import DATE_FORMAT
+from timeflow.utils import DATE_LEN
 from timeflow.utils import DATETIME_FORMAT
+from timeflow.utils import MINUTES_IN_DAY
+from timeflow.utils import SECONDS_IN_DAY
 from timeflow.utils import calc_time_diff
 from timeflow.utils import date_begins
 from timeflow.utils import date_ends
+from timeflow.utils import epoch_minutes_to_datetime
 from timeflow.utils import format_duration_long
 from timeflow.utils import format_duration_short
+from timeflow.utils import get_epoch_days
+from timeflow.utils import get_project
 from timeflow.utils import get_time
-from timeflow.utils import parse_lines
+from timeflow.utils import parse_line
 from timeflow.utils import strip_log
 
 
@@ -32,19 +44,33 @@ def get_total_stats_times(work_time, slack_time, today_work_time):
     return output
 
 
+def get_report_records(report_dict):
+    """
+    Yields (<project>, <log_message>, <accumulative time>) tuples of report
+    dict, projects sorted by name, in the order they are reported
+    """
+    for project in sorted(report_dict):
+        for log, seconds in report_dict[project].items():
+            yield project, log, seconds
+
+
 def create_report(report_dict):
     """
     Returns string output for stats report
     """
+    return create_records_report(get_report_records(report_dict))
+
+
+def create_records_report(records):
+    """
+    Returns string output for stats report from report records
+    """
     output = ""
 
-    report_dict = OrderedDict(sorted(report_dict.items()))
-    for project in report_dict:
+    for project, project_records in groupby(records, key=itemgetter(0)):
         project_output = "{}:\n".format(project)
-        project_report = report_dict[project]
         total_seconds = 0
-        for log in project_report:
-            log_seconds = project_report[log]
+        for _, log, log_seconds in project_records:
             total_seconds += log_seconds
 
             # if log is empty - just state the project name
@@ -69,9 +95,17 @@ def create_full_report(work_report_dict, slack_report_dict):
     """
     Returns report for both - work and slack
     """
+    return create_full_records_report(get_report_records(work_report_dict),
+                                      get_report_records(slack_report_dict))
+
+
+def create_full_records_report(work_records, slack_records):
+    """
+    Returns report for both - work and slack, from report records
+    """
     output = ""
-    work_report = create_report(work_report_dict)
-    slack_report = create_report(slack_report_dict)
+    work_report = create_records_report(work_records)
+    slack_report = create_records_report(slack_records)
     output += "{:-^67s}\n".format(" WORK ")
     output += work_report
     output += "\n"  # I want empty line between work and slack report
@@ -84,18 +118,24 @@ def create_report_as_gtimelog(report_dict, literal_time_range=''):
     """
     Returns string output for report which is generated as in gtimelog
     """
+    return create_records_report_as_gtimelog(get_report_records(report_dict),
+                                             literal_time_range)
+
+
+def create_records_report_as_gtimelog(records, literal_time_range=''):
+    """
+    Returns string output for report which is generated as in gtimelog,
+    from report records
+    """
     output = ""
     project_totals_output = ""
     output += "{}{}\n".format(" " * 64, "time")
 
-    report_dict = OrderedDict(sorted(report_dict.items()))
     total_seconds = 0
-    for project in report_dict:
+    for project, project_records in groupby(records, key=itemgetter(0)):
         total_project_seconds = 0
-        project_report = report_dict[project]
-        for log in project_report:
+        for _, log, seconds in project_records:
             entry = "{}: {}".format(project, log)
-            seconds = project_report[log]
             time_string = format_duration_short(seconds)
             output += "{:62s}  {}\n".format(entry, time_string)
             total_project_seconds += seconds
@@ -114,7 +154,17 @@ def create_report_as_gtimelog(report_dict, literal_time_range=''):
     return output
 
 
-def calculate_stats(lines, date_from, date_to, today=False):
+def calculate_stats(lines, date_from, date_to, today=False,
+                    filter_projects=[],
+                    exclude_projects=[],
+                    now=None,
+                    where=None):
+    """Returns lists of work and slack times, and today's working time
+
+    Today's working time is counted only if `today` is True, from the first
+    entry of the day up to `now`, which is current time by default. Only
+    entries matching `where` query are counted, if it's passed.
+    """
     work_time = []
     slack_time = []
     today_work_time = None
@@ -122,25 +172,31 @@ def calculate_stats(lines, date_from, date_to, today=False):
     line_begins = date_begins(lines, date_from)
     line_ends = date_ends(lines, date_to)
 
-    date_not_found = (line_begins is None or line_ends < line_begins)
+    date_not_found = (line_begins is None or line_ends is None or
+                      line_ends < line_begins)
     if date_not_found:
         return work_time, slack_time, today_work_time
 
-    data = parse_lines()
-
-    for i, line in enumerate(data[line_begins:line_ends + 1]):
-        # if we got to the last line - stop
-        if line_begins + i + 1 > line_ends:
-            break
+    should_be_in_stats = project_filter(filter_projects, exclude_projects)
+    matches_query = where.lines_predicate() if where else None
 
-        next_line = data[line_begins + i + 1]
-
-        line_date = line.date
-        next_line_date = next_line.date
+    for i in range(line_begins, line_ends):
+        line = lines[i]
+        next_line = lines[i + 1]
 
         # if it's day switch, skip this cycle
-        if line_date != next_line_date:
+        if line[:DATE_LEN] != next_line[:DATE_LEN]:
+            continue
+
+        # reject filtered out projects before any time parsing is done
+        if should_be_in_stats and not should_be_in_stats(get_project(next_line)):
             continue
+        # time of the line is checked before its message is parsed
+        if matches_query and not matches_query(next_line):
+            continue
+
+        line = parse_line(line)
+        next_line = parse_line(next_line)
 
         if next_line.is_slack:
             slack_time.append(calc_time_diff(line, next_line))
@@ -148,19 +204,23 @@ def calculate_stats(lines, date_from, date_to, today=False):
             work_time.append(calc_time_diff(line, next_line))
 
     if today:
+        first_line = parse_line(lines[line_begins])
         today_start_time = dt.datetime.strptime(
-            "{} {}".format(data[line_begins].date, data[line_begins].time),
+            "{} {}".format(first_line.date, first_line.time),
             DATETIME_FORMAT
         )
-        today_work_time = (dt.datetime.now() - today_start_time).seconds
+        now = now or dt.datetime.now()
+        today_work_time = (now - today_start_time).seconds
 
     return work_time, slack_time, today_work_time
 
 
 def calculate_report(lines, date_from, date_to,
                      filter_projects=[],
-                     exclude_projects=[]):
-    """Creates and returns report dictionaries
+                     exclude_projects=[],
+                     where=None):
+    """Creates and returns report dictionaries of entries, which match
+    `where` query, if it's passed
 
     Report dicts have form like this:
     {<Project>: {<log_message>: <accumulative time>},
@@ -173,61 +233,505 @@ def calculate_report(lines, date_from, date_to,
     line_begins = date_begins(lines, date_from)
     line_ends = date_ends(lines, date_to)
 
-    date_not_found = (line_begins is None or line_ends < line_begins)
+    date_not_found = (line_begins is None or line_ends is None or
+                      line_ends < line_begins)
     if date_not_found:
         return work_dict, slack_dict
 
-    data = parse_lines()
-
-    for i, line in enumerate(data[line_begins:line_ends + 1]):
-        # if we got to the last line - stop
-        if line_begins + i + 1 > line_ends:
-            break
+    should_be_in_report = project_filter(filter_projects, exclude_projects)
+    matches_query = where.lines_predicate() if where else None
 
-        next_line = data[line_begins + i + 1]
-
-        line_date = line.date
-        next_line_date = next_line.date
+    for i in range(line_begins, line_ends):
+        line = lines[i]
+        next_line = lines[i + 1]
 
         # if it's day switch, skip this cycle
-        if line_date != next_line_date:
+        if line[:DATE_LEN] != next_line[:DATE_LEN]:
+            continue
+
+        # reject filtered out projects before any time parsing is done
+        if should_be_in_report and not should_be_in_report(get_project(next_line)):
             continue
+        # time of the line is checked before its message is parsed
+        if matches_query and not matches_query(next_line):
+            continue
+
+        line = parse_line(line)
+        next_line = parse_line(next_line)
 
         time_diff = calc_time_diff(line, next_line)
 
         project = strip_log(next_line.project)
-
-        if project_should_be_in_report(project, filter_projects, exclude_projects):
-            log = strip_log(next_line.log)
-            if next_line.is_slack:
-                # if log message is identical add time_diff
-                # to total time of the log
-                if slack_dict[project][log]:
-                    total_time = slack_dict[project][log]
-                    total_time += time_diff
-                    slack_dict[project][log] = total_time
-                else:
-                    slack_dict[project][log] = time_diff
+        log = strip_log(next_line.log)
+        if next_line.is_slack:
+            # if log message is identical add time_diff
+            # to total time of the log
+            if slack_dict[project][log]:
+                total_time = slack_dict[project][log]
+                total_time += time_diff
+                slack_dict[project][log] = total_time
+            else:
+                slack_dict[project][log] = time_diff
+        else:
+            if work_dict[project][log]:
+                total_time = work_dict[project][log]
+                total_time += time_diff
+                work_dict[project][log] = total_time
             else:
-                if work_dict[project][log]:
-                    total_time = work_dict[project][log]
-                    total_time += time_diff
-                    work_dict[project][log] = total_time
-                else:
-                    work_dict[project][log] = time_diff
+                work_dict[project][log] = time_diff
 
     return work_dict, slack_dict
 
 
-def project_should_be_in_report(project, filters, excludes):
-    if project in filters:
-        return True
-    elif project in excludes:
-        return False
-    elif filters == []:
-        return True
-    elif excludes == []:
-        return False
+def iter_entry_times(entries, begin, end, should_be_in_stats=None,
+                     matches_query=None):
+    """
+    Yields index of the entry and seconds spent on it, for entries from
+    `begin` up to `end` index, which pass `should_be_in_stats` project filter
+    and `matches_query` predicate of entry indexes
+
+    Time spent on the entry is counted from the previous entry of the same
+    day, so first entries of the days are skipped.
+    """
+    minutes = entries.minutes
+    projects = entries.projects
+    for i in range(begin + 1, end):
+        if should_be_in_stats and not should_be_in_stats(projects[i]):
+            continue
+        # if it's day switch, skip this cycle
+        if minutes[i - 1] // MINUTES_IN_DAY != minutes[i] // MINUTES_IN_DAY:
+            continue
+        if matches_query and not matches_query(i):
+            continue
+        yield i, (minutes[i] - minutes[i - 1]) * 60 % SECONDS_IN_DAY
+
+
+def calculate_entries_stats(entries, date_from, date_to, today=False,
+                            filter_projects=[],
+                            exclude_projects=[],
+                            now=None,
+                            where=None):
+    """
+    Same as `calculate_stats`, but calculates stats from parsed `Entries`
+    """
+    work_time = []
+    slack_time = []
+    today_work_time = None
+
+    begin, end = entries.date_range(date_from, date_to)
+    if begin == end:
+        return work_time, slack_time, today_work_time
+
+    should_be_in_stats = entries.project_filter(filter_projects,
+                                                exclude_projects)
+    matches_query = where.entries_predicate(entries) if where else None
+    slack = entries.slack
+    for i, seconds in iter_entry_times(entries, begin, end,
+                                       should_be_in_stats, matches_query):
+        if slack[i]:
+            slack_time.append(seconds)
+        else:
+            work_time.append(seconds)
+
+    if today:
+        today_start_time = epoch_minutes_to_datetime(entries.minutes[begin])
+        now = now or dt.datetime.now()
+        today_work_time = (now - today_start_time).seconds
+
+    return work_time, slack_time, today_work_time
+
+
+def calculate_entries_report(entries, date_from, date_to,
+                             filter_projects=[],
+                             exclude_projects=[],
+                             where=None):
+    """
+    Same as `calculate_report`, but calculates report from parsed `Entries`
+
+    Times are summed up by project and log ids, strings are looked up only
+    when report dicts are created.
+    """
+    work_times = {}
+    slack_times = {}
+
+    begin, end = entries.date_range(date_from, date_to)
+    should_be_in_report = entries.project_filter(filter_projects,
+                                                 exclude_projects)
+    matches_query = where.entries_predicate(entries) if where else None
+    projects = entries.projects
+    logs = entries.logs
+    slack = entries.slack
+    for i, seconds in iter_entry_times(entries, begin, end,
+                                       should_be_in_report, matches_query):
+        times = slack_times if slack[i] else work_times
+        key = (projects[i], logs[i])
+        times[key] = times.get(key, 0) + seconds
+
+    return (_create_report_dict(entries, work_times),
+            _create_report_dict(entries, slack_times))
+
+
+def _create_report_dict(entries, times):
+    report_dict = defaultdict(lambda: defaultdict(dict))
+    for (project_id, log_id), seconds in times.items():
+        project = entries.project_names[project_id]
+        log = entries.log_names[log_id]
+        report_dict[project][log] = seconds
+    return report_dict
+
+
+def calculate_entries_report_records(entries, date_from, date_to,
+                                     filter_projects=[],
+                                     exclude_projects=[],
+                                     limit=None,
+                                     where=None):
+    """
+    Same as `calculate_entries_report`, but in bounded memory
+
+    No more than `limit` log times are summed up in memory, the rest are
+    spilled to temporary files and merged afterwards. Returns work and slack
+    report records, which are iterators of (<project>, <log_message>,
+    <accumulative time>) tuples in the same order as from
+    `get_report_records`.
+    """
+    work_times = SpillingCounter(limit)
+    slack_times = SpillingCounter(limit)
+
+    begin, end = entries.date_range(date_from, date_to)
+    should_be_in_report = entries.project_filter(filter_projects,
+                                                 exclude_projects)
+    matches_query = where.entries_predicate(entries) if where else None
+    projects = entries.projects
+    logs = entries.logs
+    slack = entries.slack
+    for i, seconds in iter_entry_times(entries, begin, end,
+                                       should_be_in_report, matches_query):
+        times = slack_times if slack[i] else work_times
+        times.add((projects[i], logs[i]), seconds)
+
+    return (_iter_report_records(entries, work_times, limit),
+            _iter_report_records(entries, slack_times, limit))
+
+
+def _iter_report_records(entries, times, limit):
+    # logs are sorted by project name and then by the order they first
+    # appeared in, as dicts made by `calculate_entries_report` are
+    records = SpillingCounter(limit)
+    for (project_id, log_id), order, seconds in times.items():
+        records.add((entries.project_names[project_id], order,
+                     entries.log_names[log_id]), seconds)
+    times.close()
+
+    for (project, _, log), _, seconds in records.items():
+        yield project, log, seconds
+    records.close()
+
+
+def calculate_ranges_stats(entries, ranges,
+                           filter_projects=[],
+                           exclude_projects=[],
+                           where=None):
+    """
+    Returns work and slack times by project for each of date `ranges`
+
+    Result is a list of (<work dict>, <slack dict>) tuples, where dicts look
+    like {<project>: <accumulative time>}. All ranges are calculated in one
+    pass over the entries, overlapping ranges are not iterated twice.
+    """
+    bounds = [entries.date_range(date_from, date_to)
+              for date_from, date_to in ranges]
+    times = [(defaultdict(int), defaultdict(int)) for _ in ranges]
+
+    # merge ranges into non overlapping spans of entries
+    spans = []
+    for begin, end in sorted(bounds):
+        if spans and begin <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([begin, end])
+
+    should_be_in_stats = entries.project_filter(filter_projects,
+                                                exclude_projects)
+    matches_query = where.entries_predicate(entries) if where else None
+    projects = entries.projects
+    slack = entries.slack
+    for begin, end in spans:
+        for i, seconds in iter_entry_times(entries, begin, end,
+                                           should_be_in_stats, matches_query):
+            for (range_begin, range_end), range_times in zip(bounds, times):
+                if range_begin <= i < range_end:
+                    range_times[slack[i]][projects[i]] += seconds
+
+    project_names = entries.project_names
+    return [
+        ({project_names[project]: seconds
+          for project, seconds in work_times.items()},
+         {project_names[project]: seconds
+          for project, seconds in slack_times.items()})
+        for work_times, slack_times in times
+    ]
+
+
+def format_duration_delta(seconds):
+    "Formats signed difference of durations"
+    if seconds > 0:
+        return '+' + format_duration_short(seconds)
+    elif seconds < 0:
+        return '-' + format_duration_short(-seconds)
+    return format_duration_short(0)
+
+
+def create_ranges_output(ranges, ranges_stats):
+    """
+    Returns string output for stats of several date ranges, side by side
+
+    Every other range is compared to the first one, difference is shown in
+    the columns after the ranges.
+    """
+    def row(label, values):
+        return "{:24s}".format(label) + "".join(
+            "{:26s}".format(value) for value in values
+        ).rstrip() + "\n"
+
+    def duration_row(label, seconds):
+        deltas = [format_duration_delta(seconds[0] - other)
+                  for other in seconds[1:]]
+        return row(label, [format_duration_short(s) for s in seconds] + deltas)
+
+    labels = [date_from if date_from == date_to
+              else "{} - {}".format(date_from, date_to)
+              for date_from, date_to in ranges]
+    deltas = ["Change vs #{}".format(i) for i in range(2, len(ranges) + 1)]
+    if len(ranges) == 2:
+        deltas = ["Change"]
+    output = row("", labels + deltas)
+
+    work_dicts = [work_times for work_times, _ in ranges_stats]
+    slack_dicts = [slack_times for _, slack_times in ranges_stats]
+    output += duration_row("Work", [sum(d.values()) for d in work_dicts])
+    output += duration_row("Slack", [sum(d.values()) for d in slack_dicts])
+
+    for title, dicts in (("Work", work_dicts), ("Slack", slack_dicts)):
+        projects = sorted(set().union(*dicts))
+        if projects:
+            output += "\n{} by project:\n".format(title)
+        for project in projects:
+            output += duration_row(project, [d.get(project, 0) for d in dicts])
+
+    return output.rstrip("\n")
+
+
+def calculate_daily_totals(entries, date_from, date_to,
+                           filter_projects=[],
+                           exclude_projects=[],
+                           where=None):
+    """
+    Returns lists of work and slack seconds of every day from `date_from`
+    to `date_to`, days without entries have zeros
+    """
+    first_day = get_epoch_days(date_from)
+    days = get_epoch_days(date_to) - first_day + 1
+    work_totals = [0] * days
+    slack_totals = [0] * days
+
+    begin, end = entries.date_range(date_from, date_to)
+    should_be_in_stats = entries.project_filter(filter_projects,
+                                                exclude_projects)
+    matches_query = where.entries_predicate(entries) if where else None
+    minutes = entries.minutes
+    slack = entries.slack
+    for i, seconds in iter_entry_times(entries, begin, end,
+                                       should_be_in_stats, matches_query):
+        day = minutes[i] // MINUTES_IN_DAY - first_day
+        if slack[i]:
+            slack_totals[day] += seconds
+        else:
+            work_totals[day] += seconds
+    return work_totals, slack_totals
+
+
+def sliding_sums(values, window):
+    "Returns sums of the last `window` values up to every value"
+    sums = []
+    total = 0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        sums.append(total)
+    return sums
+
+
+def calculate_rolling_stats(entries, date_from, date_to, windows,
+                            filter_projects=[],
+                            exclude_projects=[],
+                            where=None):
+    """
+    Returns rolling work and slack times for every day of date range
+
+    Result is a list of (<date>, [(<work time>, <slack time>), ...]) tuples,
+    with the times of every window of `windows` days, which ends with that
+    day. Daily totals are calculated in one pass over entries, also for the
+    days before `date_from`, which get into the windows. Windows reach back
+    no further than the first entry of the log, as days before it are
+    empty anyway.
+    """
+    lead_days = max(windows) - 1
+    if len(entries):
+        # windows longer than the log would go beyond the supported dates
+        lead_days = min(lead_days, max(
+            0, get_epoch_days(date_from) -
+            entries.minutes[0] // MINUTES_IN_DAY))
+    else:
+        lead_days = 0
+    first_day = get_epoch_days(date_from) - lead_days
+    first_date = epoch_minutes_to_datetime(first_day * MINUTES_IN_DAY)
+    work_totals, slack_totals = calculate_daily_totals(
+        entries,
+        first_date.strftime(DATE_FORMAT),
+        date_to,
+        filter_projects=filter_projects,
+        exclude_projects=exclude_projects,
+        where=where,
+    )
+    window_sums = [
+        list(zip(sliding_sums(work_totals, window),
+                 sliding_sums(slack_totals, window)))
+        for window in windows
+    ]
+
+    rolling_stats = []
+    for day in range(lead_days, len(work_totals)):
+        date = epoch_minutes_to_datetime(
+            (first_day + day) * MINUTES_IN_DAY
+        ).strftime(DATE_FORMAT)
+        rolling_stats.append((date, [sums[day] for sums in window_sums]))
+    return rolling_stats
+
+
+def get_rolling_records(windows, rolling_stats):
+    "Returns rolling stats as list of dicts with times in seconds"
+    records = []
+    for date, times in rolling_stats:
+        record = {'date': date}
+        for window, (work_time, slack_time) in zip(windows, times):
+            record['work_{}d'.format(window)] = work_time
+            record['slack_{}d'.format(window)] = slack_time
+        records.append(record)
+    return records
+
+
+def create_rolling_output(windows, rolling_stats, output_format='text'):
+    """
+    Returns string output of rolling stats as a table of hours, or as CSV
+    or JSON with times in seconds
+    """
+    records = get_rolling_records(windows, rolling_stats)
+    fields = ['date']
+    for window in windows:
+        fields += ['work_{}d'.format(window), 'slack_{}d'.format(window)]
+
+    if output_format == 'json':
+        return json.dumps(records, indent=2)
+    elif output_format == 'csv':
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fields, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+        return output.getvalue().rstrip('\n')
+
+    output = "{:12s}".format("Date")
+    for window in windows:
+        output += "{:>12s}{:>12s}".format("Work {}d".format(window),
+                                          "Slack {}d".format(window))
+    for record in records:
+        output += "\n{:12s}".format(record['date'])
+        output += "".join("{:>12.1f}".format(record[field] / 3600)
+                          for field in fields[1:])
+    return output
+
+
+def calculate_top(entries, date_from, date_to, k, by='project',
+                  filter_projects=[],
+                  exclude_projects=[],
+                  where=None):
+    """
+    Returns `k` projects, or logs if `by` is 'log', which took most of the
+    work time and of the slack time
+
+    Result is two (<top list>, <total time>) tuples, for work and for slack.
+    Top lists have (<name>, <accumulative time>) tuples, longest first.
+    """
+    work_times = defaultdict(int)
+    slack_times = defaultdict(int)
+
+    begin, end = entries.date_range(date_from, date_to)
+    should_be_in_stats = entries.project_filter(filter_projects,
+                                                exclude_projects)
+    matches_query = where.entries_predicate(entries) if where else None
+    projects = entries.projects
+    logs = entries.logs
+    slack = entries.slack
+    for i, seconds in iter_entry_times(entries, begin, end,
+                                       should_be_in_stats, matches_query):
+        times = slack_times if slack[i] else work_times
+        if by == 'log':
+            times[projects[i], logs[i]] += seconds
+        else:
+            times[projects[i]] += seconds
+
+    def name(key):
+        if by != 'log':
+            return entries.project_names[key]
+        project = entries.project_names[key[0]]
+        log = entries.log_names[key[1]]
+        # if log is empty - just state the project name
+        return "{}: {}".format(project, log) if log else project
+
+    return tuple(
+        ([(name(key), seconds)
+          for key, seconds in heapq.nlargest(k, times.items(),
+                                             key=itemgetter(1))],
+         sum(times.values()))
+        for times in (work_times, slack_times)
+    )
+
+
+def create_top_output(work_top, slack_top):
+    """
+    Returns string output for top projects or logs with their share of the
+    total work or slack time
+    """
+    output = ""
+    for title, (top, total_seconds) in (("Work", work_top),
+                                        ("Slack", slack_top)):
+        output += "{}: {}\n".format(title,
+                                    format_duration_short(total_seconds))
+        for name, seconds in top:
+            # entries may take no time, if they are logged at the same minute
+            share = 100.0 * seconds / total_seconds if total_seconds else 0.0
+            output += "    {:16s}{:>6.1f}%  {}\n".format(
+                format_duration_long(seconds), share, name,
+            )
+        output += "\n"
+    return output.strip("\n")
+
+
+def project_filter(filter_projects, exclude_projects):
+    """Returns predicate, which tells if project should be in stats or report
+
+    Projects listed in `filter_projects` are always included, and if there
+    are any, all the other projects are left out. Otherwise projects listed
+    in `exclude_projects` are left out. Returns `None` when nothing has to be
+    filtered, so callers can skip the check altogether.
+    """
+    filters = frozenset(filter_projects)
+    excludes = frozenset(exclude_projects)
+    if filters:
+        return filters.__contains__
+    elif excludes:
+        return lambda project: project not in excludes
+    return None
 
 
 def get_daily_report_subject(day, person):
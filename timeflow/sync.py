@@ -0,0 +1,308 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+
+from contextlib import closing
+
+from timeflow import utils
+from timeflow.sort import merge_runs
+from timeflow.utils import DATE_LEN
+from timeflow.utils import DATETIME_LEN
+from timeflow.views import iter_line_bounds
+
+DAYS_VERSION = 2
+# size of chunks unchanged bytes are copied in
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_days_file(log_file):
+    "Returns file path of day blocks of the log file, which is unique for it"
+    return utils.get_cache_file(log_file, '.days')
+
+
+def hash_blocks(buf, start=0):
+    """
+    Returns list of [<date>, <start>, <end>, <hash>] blocks of days of log
+    file buffer `buf`, e.g. memory mapped log file, starting at `start`
+
+    Block spans lines of the same date, from the beginning of the first one
+    up to the end of the last one. Hash is made of the lines only, so new
+    line chars and empty lines do not matter.
+    """
+    blocks = []
+    block_hash = None
+    for line_start, line_end, next_start in iter_line_bounds(buf, start):
+        date = buf[line_start:line_start + DATE_LEN].decode('utf-8')
+        if not blocks or blocks[-1][0] != date:
+            if block_hash:
+                blocks[-1][3] = block_hash.hexdigest()
+            blocks.append([date, line_start, None, None])
+            block_hash = hashlib.sha1()
+        block_hash.update(buf[line_start:line_end])
+        block_hash.update(b'\n')
+        blocks[-1][2] = len(buf) if next_start is None else next_start
+    if block_hash:
+        blocks[-1][3] = block_hash.hexdigest()
+    return blocks
+
+
+def _open_days(log_file):
+    "Returns connection to day blocks database of the log file"
+    days_file = get_days_file(log_file)
+    days = sqlite3.connect(days_file, isolation_level=None)
+    try:
+        days.execute('CREATE TABLE IF NOT EXISTS meta '
+                     '(key TEXT PRIMARY KEY, value)')
+        days.execute('CREATE TABLE IF NOT EXISTS blocks '
+                     '(position INTEGER PRIMARY KEY, date TEXT, '
+                     'start INTEGER, end INTEGER, hash TEXT)')
+    except sqlite3.DatabaseError:
+        # broken database is made again
+        days.close()
+        os.remove(days_file)
+        return _open_days(log_file)
+    return days
+
+
+def _add_blocks(days, fp, blocks, size):
+    "Adds blocks of the first `size` bytes of the log file to day blocks"
+    days.executemany('INSERT INTO blocks (date, start, end, hash) '
+                     'VALUES (?, ?, ?, ?)', blocks)
+    meta = utils.get_file_state(fp, size)
+    meta['version'] = DAYS_VERSION
+    days.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                     sorted(meta.items()))
+
+
+def _hash_new_blocks(days, fp, start):
+    "Adds blocks of the log file from `start` offset up to its end"
+    size = os.fstat(fp.fileno()).st_size
+    blocks = []
+    if start < size:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            blocks = hash_blocks(buf, start)
+            size = len(buf)
+    _add_blocks(days, fp, blocks, size)
+
+
+def _replace_blocks(log_file, path, blocks):
+    """
+    Replaces day blocks of the log file with `blocks` of the file at `path`,
+    which is going to replace the log file
+    """
+    with open(path, 'rb') as fp, closing(_open_days(log_file)) as days:
+        days.execute('BEGIN IMMEDIATE')
+        days.execute('DELETE FROM blocks')
+        _add_blocks(days, fp, blocks, os.fstat(fp.fileno()).st_size)
+        days.execute('COMMIT')
+
+
+def get_day_blocks(log_file):
+    """
+    Returns list of (<date>, <start>, <end>, <hash>) blocks of days of the
+    log file, in the order they are in the log file
+
+    Blocks are kept in SQLite database in cache directory. If log file was
+    only appended to, see `utils.is_appended`, only its last day, which may
+    have got new lines, and appended days are read and hashed. Whole log
+    file is hashed again, if it was rewritten.
+    """
+    with open(log_file, 'rb') as fp, closing(_open_days(log_file)) as days:
+        stat = os.fstat(fp.fileno())
+        # days are locked, so that the same blocks are not added twice
+        days.execute('BEGIN IMMEDIATE')
+        meta = dict(days.execute('SELECT key, value FROM meta'))
+        if (meta.get('version') == DAYS_VERSION and
+                utils.is_appended(fp, meta)):
+            if (meta['file_size'], meta['mtime']) != (stat.st_size,
+                                                      stat.st_mtime_ns):
+                last_block = days.execute(
+                    'SELECT position, start FROM blocks '
+                    'ORDER BY position DESC LIMIT 1'
+                ).fetchone()
+                start = 0
+                if last_block:
+                    days.execute('DELETE FROM blocks WHERE position = ?',
+                                 (last_block[0],))
+                    start = last_block[1]
+                _hash_new_blocks(days, fp, start)
+        else:
+            days.execute('DELETE FROM blocks')
+            _hash_new_blocks(days, fp, 0)
+        blocks = days.execute('SELECT date, start, end, hash FROM blocks '
+                              'ORDER BY position').fetchall()
+        days.execute('COMMIT')
+    return blocks
+
+
+def _read_block_lines(fp, block):
+    "Returns lines of the block, each of them ending with new line char"
+    _, start, end, _ = block
+    fp.seek(start)
+    return [line.rstrip('\r\n') + '\n'
+            for line in fp.read(end - start).decode('utf-8').splitlines()
+            if line.strip()]
+
+
+def merge_days(local_fp, local_blocks, other_fp, other_blocks):
+    """
+    Returns dict of merged lines of the days, which are different in local
+    and other log
+
+    Lines of the day are merged chronologically, dropping exact duplicates.
+    """
+    merged_days = {}
+    for date in sorted(set(local_blocks) | set(other_blocks)):
+        local_block = local_blocks.get(date)
+        other_block = other_blocks.get(date)
+        if local_block and other_block and local_block[3] == other_block[3]:
+            continue
+        runs = []
+        for fp, block in ((local_fp, local_block), (other_fp, other_block)):
+            if block:
+                # sort is stable, so entries of the same minute keep order
+                runs.append(sorted(_read_block_lines(fp, block),
+                                   key=lambda line: line[:DATETIME_LEN]))
+        merged_days[date] = list(merge_runs(runs))
+    return merged_days
+
+
+def _copy_range(src, dst, start, end):
+    src.seek(start)
+    while start < end:
+        chunk = src.read(min(COPY_CHUNK_SIZE, end - start))
+        if not chunk:
+            break
+        dst.write(chunk)
+        start += len(chunk)
+
+
+def rewrite_log(log_file, blocks, merged_days, stat=None):
+    """
+    Rewrites log file with the merged days by `utils.rewrite_file`, returns
+    number of lines added to it
+
+    Bytes of the unchanged days, also empty lines between them, are copied
+    as they are. Merged days are separated from other days with an empty
+    line. `stat` is stat of log file, which `blocks` were got from.
+
+    Day blocks of the rewritten log file are known, while it's written, so
+    they are kept and it's not hashed again.
+    """
+    with utils.rewrite_file(log_file, stat) as tmp_file:
+        added_lines, new_blocks = _write_merged_log(log_file, tmp_file,
+                                                    blocks, merged_days)
+        _replace_blocks(log_file, tmp_file, new_blocks)
+    return added_lines
+
+
+def _write_merged_log(log_file, tmp_file, blocks, merged_days):
+    "Returns number of added lines and day blocks of the written log file"
+    dates = {block[0]: block for block in blocks}
+    added_lines = 0
+    new_blocks = []
+    with open(log_file, 'rb') as src, open(tmp_file, 'wb') as dst:
+        # end of the previous day's block, if the day was in the log file
+        previous_end = None
+        for i, date in enumerate(sorted(set(dates) | set(merged_days))):
+            block = dates.get(date)
+            lines = merged_days.get(date)
+            if i == 0 and block is not None:
+                _copy_range(src, dst, 0, block[1])
+            elif previous_end is not None and block is not None:
+                # empty lines between the days are kept as they are
+                _copy_range(src, dst, previous_end, block[1])
+            elif i > 0:
+                dst.write(b'\n')
+
+            start = dst.tell()
+            if lines is None:
+                _copy_range(src, dst, block[1], block[2])
+                src.seek(block[2] - 1)
+                if src.read(1) != b'\n':
+                    dst.write(b'\n')
+                block_hash = block[3]
+            else:
+                if block is not None:
+                    added_lines -= len(_read_block_lines(src, block))
+                added_lines += len(lines)
+                data = ''.join(lines).encode('utf-8')
+                dst.write(data)
+                block_hash = hashlib.sha1(data).hexdigest()
+            new_blocks.append((date, start, dst.tell(), block_hash))
+            previous_end = block[2] if block is not None else None
+
+        if previous_end is not None:
+            # so are empty lines at the end of the log file
+            _copy_range(src, dst, previous_end,
+                        os.fstat(src.fileno()).st_size)
+    return added_lines, new_blocks
+
+
+def _check_sorted(log_file, blocks):
+    for previous, block in zip(blocks, blocks[1:]):
+        if previous[0] >= block[0]:
+            raise ValueError("Days of {} are not sorted, sort it first"
+                             .format(log_file))
+
+
+def get_other_log_file(other_path):
+    "Returns log file path of other log, which may be a directory of it"
+    if os.path.isdir(other_path):
+        return os.path.join(other_path, os.path.basename(utils.LOG_FILE))
+    return other_path
+
+
+def sync_log(other_path):
+    """
+    Merges days, which are different in the log and other log, into both
+    of them
+
+    Days are compared by hashes of their blocks, so only days which differ
+    are read and merged. Logs are rewritten atomically, only if they got
+    new lines. Returns number of different days and numbers of lines added
+    to the log and to the other log.
+
+    Raises ValueError if days of some log are not sorted, logs are
+    rewritten as `rewrite_log` does.
+    """
+    other_file = get_other_log_file(other_path)
+    for log_file in (utils.LOG_FILE, other_file):
+        # log, which doesn't exist yet, gets all days of the other one
+        if not os.path.exists(log_file):
+            open(log_file, 'a').close()
+    # logs are expected to be unchanged since they were stat'ed, as their
+    # blocks are read later and without lock
+    stats = {log_file: os.stat(log_file)
+             for log_file in (utils.LOG_FILE, other_file)}
+    local_blocks = get_day_blocks(utils.LOG_FILE)
+    other_blocks = get_day_blocks(other_file)
+    _check_sorted(utils.LOG_FILE, local_blocks)
+    _check_sorted(other_file, other_blocks)
+
+    with open(utils.LOG_FILE, 'rb') as local_fp, \
+            open(other_file, 'rb') as other_fp:
+        merged_days = merge_days(
+            local_fp, {block[0]: block for block in local_blocks},
+            other_fp, {block[0]: block for block in other_blocks},
+        )
+    if not merged_days:
+        return 0, 0, 0
+
+    added_lines = []
+    for log_file, blocks in ((utils.LOG_FILE, local_blocks),
+                             (other_file, other_blocks)):
+        # days, which are merged to the same lines, are kept as they are
+        blocks_by_date = {block[0]: block for block in blocks}
+        with open(log_file, 'rb') as fp:
+            changed_days = {
+                date: lines for date, lines in merged_days.items()
+                if date not in blocks_by_date or
+                _read_block_lines(fp, blocks_by_date[date]) != lines
+            }
+        added_lines.append(
+            rewrite_log(log_file, blocks, changed_days, stats[log_file])
+            if changed_days else 0
+        )
+    return len(merged_days), added_lines[0], added_lines[1]
@@ -1,10 +1,32 @@
+import contextlib
 import datetime
+import gzip
+import hashlib
+import json
 import os
+import threading
+import urllib.error
+import urllib.request
 
 import pytest
 
+import timeflow
+import timeflow.binlog
+import timeflow.cache
+import timeflow.compact
+import timeflow.debug
+import timeflow.entries
+import timeflow.query
+import timeflow.search
+import timeflow.watch
+import timeflow.server
+import timeflow.snapshot
+import timeflow.sort
+import timeflow.sync
 import timeflow.utils
+import timeflow.views
 from timeflow import cli
+from timeflow import stats
 
 FAKE_TIME = datetime.datetime(2015, 1, 1, 23, 59, 59)
 
@@ -20,6 +42,12 @@ def patch_datetime_now(monkeypatch):
     monkeypatch.setattr(datetime, 'datetime', mydatetime)
 
 
+@pytest.fixture(autouse=True)
+def tmp_cache_dir(tmpdir):
+    # do not let tests to share cached results
+    timeflow.utils.CACHE_DIR = tmpdir.join("cache").strpath
+
+
 def test_patch_datetime(patch_datetime_now):
     assert datetime.datetime.now() == FAKE_TIME
 
@@ -315,3 +343,1323 @@ def test_stats_now_report_as_gtimelog(patch_datetime_now, capsys):
         "Timeflow                                                        1 hour 15 min\n\n"
     )
     assert out == result
+
+
+def test_stats_filter_projects(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats', '--day', '2015-01-01',
+                              '--filter-projects', 'Django,Breakfast'])
+    args.func(args)
+
+    # extract STDOUT, as stats command prints to it
+    out, err = capsys.readouterr()
+    result = ("Work: 1 hour 35 min\n"
+              "Slack: 45 min\n")
+    assert out == result
+
+
+def test_stats_exclude_projects(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats', '--day', '2015-01-01',
+                              '--exclude-projects', 'Django,Slack'])
+    args.func(args)
+
+    # extract STDOUT, as stats command prints to it
+    out, err = capsys.readouterr()
+    result = ("Work: 1 hour 15 min\n"
+              "Slack: 45 min\n")
+    assert out == result
+
+
+def test_stats_exclude_projects_report(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats', '--report',
+                              '--exclude-projects', 'Django,Slack'])
+    args.func(args)
+
+    # extract STDOUT, as stats command prints to it
+    out, err = capsys.readouterr()
+    result = (
+        "------------------------------ WORK -------------------------------\n"
+        "Timeflow:\n"
+        "    1 hour 15 min: start project\n"
+        "    Total: 1 hour 15 min\n"
+        "------------------------------ SLACK ------------------------------\n"
+        "Breakfast:\n"
+        "    0 hours 45 min: Breakfast\n"
+        "    Total: 0 hours 45 min\n"
+    )
+    assert out == result
+
+
+def test_search(tmpdir, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # copy fake log, as it is going to be changed
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(test_dir + '/fake_log.txt') as src, open(tmp_path, 'w') as dst:
+        dst.write(src.read())
+    timeflow.utils.LOG_FILE = tmp_path
+
+    # run search command
+    parser = cli.create_parser()
+    args = parser.parse_args(['search', 'task'])
+    args.func(args)
+
+    # extract STDOUT, as search command prints to it
+    out, err = capsys.readouterr()
+    result = ("2015-01-02 10:00  0 hours 45 min  Work: finish task #115\n"
+              "2015-01-02 12:00  1 hour 35 min   Work: working on task #42\n"
+              "\n"
+              "Work: 2 hours 20 min\n"
+              "Slack: 0 min\n")
+    assert out == result
+    index_file = timeflow.search.get_index_file()
+    assert os.path.dirname(index_file) == timeflow.utils.CACHE_DIR
+
+    # appended entries are found using the same index, incomplete line is
+    # indexed, when it's complete
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:00: Work: review ABC-123\n'
+                 '2015-01-02 14:30: Work: review ABC')
+    inode = os.stat(index_file).st_ino
+    args = parser.parse_args(['search', 'abc-123', '--from', '2015-01-02'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    result = ("2015-01-02 14:00  0 hours 55 min  Work: review ABC-123\n"
+              "\n"
+              "Work: 55 min\n"
+              "Slack: 0 min\n")
+    assert out == result
+    assert os.stat(index_file).st_ino == inode
+
+    with open(tmp_path, 'a') as fp:
+        fp.write('-123\n')
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out.startswith("2015-01-02 14:00  0 hours 55 min  "
+                          "Work: review ABC-123\n"
+                          "2015-01-02 14:30  0 hours 30 min  "
+                          "Work: review ABC-123\n")
+
+    # rewritten log is indexed again
+    with open(tmp_path, 'r') as fp:
+        content = fp.read()
+    with open(tmp_path + '.tmp', 'w') as fp:
+        fp.write(content.replace('review ABC-123', 'review XYZ-1'))
+    os.replace(tmp_path + '.tmp', tmp_path)
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == "Work: 0 min\nSlack: 0 min\n"
+
+
+def test_stats_cache(patch_datetime_now, tmpdir, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # copy fake log, as it is going to be changed
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(test_dir + '/fake_log.txt') as src, open(tmp_path, 'w') as dst:
+        dst.write(src.read())
+    timeflow.utils.LOG_FILE = tmp_path
+
+    parser = cli.create_parser()
+    result = ("Work: 2 hours 50 min\n"
+              "Slack: 1 hour 10 min\n")
+    for i in range(2):
+        args = parser.parse_args(['stats', '--last-week'])
+        args.func(args)
+        out, err = capsys.readouterr()
+        assert out == result
+
+    # entries out of the date range do not invalidate cached result
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:00: Work: review\n')
+    args = parser.parse_args(['stats', '--last-week'])
+    args.func(args)
+    out, err = capsys.readouterr()
+    assert out == result
+
+    args = parser.parse_args(['cache'])
+    args.func(args)
+    out, err = capsys.readouterr()
+    assert out == "Hits: 2\nMisses: 1\n"
+
+    # changed entries in the date range do
+    with open(tmp_path, 'r') as fp:
+        content = fp.read()
+    with open(tmp_path, 'w') as fp:
+        fp.write(content.replace('2014-12-24 12:00', '2014-12-24 12:30'))
+    args = parser.parse_args(['stats', '--last-week'])
+    args.func(args)
+    out, err = capsys.readouterr()
+    assert out == ("Work: 3 hours 20 min\n"
+                   "Slack: 1 hour 10 min\n")
+
+    # cached results are not used with --no-cache
+    args = parser.parse_args(['stats', '--last-week', '--no-cache'])
+    args.func(args)
+
+    args = parser.parse_args(['cache', 'clear'])
+    args.func(args)
+    args = parser.parse_args(['cache'])
+    args.func(args)
+    out, err = capsys.readouterr()
+    assert out == ("Work: 3 hours 20 min\n"
+                   "Slack: 1 hour 10 min\n"
+                   "Cache cleared\n"
+                   "Hits: 0\nMisses: 0\n")
+
+
+def test_cache_evict(tmpdir):
+    for i in range(5):
+        timeflow.cache.save(str(i), 'x' * 100)
+    timeflow.cache.evict(max_size=250)
+    assert timeflow.cache.load('0') is None
+    assert timeflow.cache.load('4') == 'x' * 100
+
+
+def test_rewrite_file(tmpdir):
+    path = tmpdir.join("test_log.txt").strpath
+    with open(path, 'w') as fp:
+        fp.write('old\n')
+
+    def list_tmp_files():
+        return [name for name in os.listdir(tmpdir.strpath)
+                if name.endswith('.tmp')]
+
+    # file is replaced, when the block is done
+    with timeflow.utils.rewrite_file(path) as tmp_file:
+        with open(tmp_file, 'w') as fp:
+            fp.write('new\n')
+    with open(path, 'r') as fp:
+        assert fp.read() == 'new\n'
+    assert list_tmp_files() == []
+
+    # file changed by other program meanwhile is left as it is
+    with pytest.raises(ValueError) as e:
+        with timeflow.utils.rewrite_file(path) as tmp_file:
+            with open(tmp_file, 'w') as fp:
+                fp.write('rewritten\n')
+            with open(path, 'a') as fp:
+                fp.write('appended\n')
+    assert 'has changed' in str(e.value)
+    with open(path, 'r') as fp:
+        assert fp.read() == 'new\nappended\n'
+    assert list_tmp_files() == []
+
+    # temporary file is removed, if the block fails
+    with pytest.raises(RuntimeError):
+        with timeflow.utils.rewrite_file(path) as tmp_file:
+            with open(tmp_file, 'w') as fp:
+                fp.write('rewritten\n')
+            raise RuntimeError
+    with open(path, 'r') as fp:
+        assert fp.read() == 'new\nappended\n'
+    assert list_tmp_files() == []
+
+    # file is checked against stat, which was taken before it was read
+    stat = os.stat(path)
+    with open(path, 'a') as fp:
+        fp.write('appended\n')
+    with pytest.raises(ValueError):
+        with timeflow.utils.rewrite_file(path, stat) as tmp_file:
+            open(tmp_file, 'w').close()
+    assert os.path.getsize(path) == len('new\nappended\nappended\n')
+    assert list_tmp_files() == []
+
+
+def append_while_rewritten(monkeypatch, line):
+    "Makes `utils.rewrite_file` append `line` to the file it rewrites"
+    rewrite_file = timeflow.utils.rewrite_file
+
+    @contextlib.contextmanager
+    def append_and_rewrite_file(path, stat=None):
+        with rewrite_file(path, stat) as tmp_file:
+            with open(path, 'a') as fp:
+                fp.write(line)
+            yield tmp_file
+    monkeypatch.setattr(timeflow.utils, 'rewrite_file',
+                        append_and_rewrite_file)
+
+
+def test_sort(tmpdir, capsys, monkeypatch):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    other_path = tmpdir.join("other_log.txt").strpath
+    timeflow.utils.LOG_FILE = tmp_path
+
+    with open(tmp_path, 'w') as fp:
+        fp.write('2015-01-02 08:00: Arrived.\n'
+                 '2015-01-02 09:00: Timeflow: sort\n'
+                 '\n'
+                 '2015-01-01 08:00: Arrived.\n'
+                 '2015-01-01 09:00: Timeflow: start project\n'
+                 '2015-01-02 08:30: Breakfast **\n')
+    with open(other_path, 'w') as fp:
+        fp.write('2015-01-01 09:00: Timeflow: start project\n'
+                 '2015-01-01 10:00: Django: read documentation')
+
+    # run sort command, with small runs to have them merged in passes
+    monkeypatch.setattr(timeflow.sort, 'RUN_SIZE', 2)
+    monkeypatch.setattr(timeflow.sort, 'MERGE_FAN_IN', 2)
+    # runs are written next to the log file, not into in memory tmpfs
+    runs_dirs = []
+    write_sorted_runs = timeflow.sort.write_sorted_runs
+
+    def record_write_sorted_runs(lines, run_size, directory):
+        runs_dirs.append(os.path.dirname(directory))
+        return write_sorted_runs(lines, run_size, directory)
+    monkeypatch.setattr(timeflow.sort, 'write_sorted_runs',
+                        record_write_sorted_runs)
+    parser = cli.create_parser()
+    args = parser.parse_args(['sort', '--merge', other_path])
+    args.func(args)
+    assert runs_dirs == [tmpdir.strpath]
+
+    out, err = capsys.readouterr()
+    assert out == "Sorted 6 entries, dropped 1 duplicates\n"
+
+    with open(tmp_path, 'r') as fp:
+        assert fp.read() == ('2015-01-01 08:00: Arrived.\n'
+                             '2015-01-01 09:00: Timeflow: start project\n'
+                             '2015-01-01 10:00: Django: read documentation\n'
+                             '\n'
+                             '2015-01-02 08:00: Arrived.\n'
+                             '2015-01-02 08:30: Breakfast **\n'
+                             '2015-01-02 09:00: Timeflow: sort\n')
+    assert not [name for name in os.listdir(tmpdir.strpath)
+                if name.endswith('.tmp')]
+
+    # log changed by other program, while it's sorted, is left as it is
+    append_while_rewritten(monkeypatch, '2015-01-01 07:00: Arrived.\n')
+    with pytest.raises(SystemExit):
+        args.func(args)
+    with open(tmp_path, 'r') as fp:
+        assert fp.read().endswith('2015-01-01 07:00: Arrived.\n')
+
+    # missing log file to merge is reported, log is left as it is
+    with pytest.raises(SystemExit) as e:
+        args = parser.parse_args(['sort', '--merge',
+                                  tmpdir.join("missing.txt").strpath])
+        args.func(args)
+    assert "missing.txt doesn't exist" in str(e.value)
+
+
+def test_sync(tmpdir, capsys, monkeypatch):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    other_dir = tmpdir.mkdir("other")
+    other_path = other_dir.join("test_log.txt").strpath
+    timeflow.utils.LOG_FILE = tmp_path
+
+    with open(tmp_path, 'w') as fp:
+        fp.write('2015-01-01 08:00: Arrived.\n'
+                 '2015-01-01 09:00: Timeflow: start project\n'
+                 '\n'
+                 '\n'
+                 '2015-01-02 08:00: Arrived.\n'
+                 '2015-01-02 09:00: Timeflow: sync\n'
+                 '\n'
+                 '2015-01-04 08:00: Arrived.\n')
+    with open(other_path, 'w') as fp:
+        fp.write('2015-01-01 08:00: Arrived.\n'
+                 '2015-01-01 09:00: Timeflow: start project\n'
+                 '\n'
+                 '2015-01-02 08:00: Arrived.\n'
+                 '2015-01-02 08:30: Breakfast **\n'
+                 '\n'
+                 '2015-01-03 08:00: Arrived.\n')
+
+    # run sync command with directory of other log
+    parser = cli.create_parser()
+    args = parser.parse_args(['sync', other_dir.strpath])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == ("Merged 3 days, added 2 lines to the log and 2 lines to "
+                   "the other log\n")
+
+    # empty lines between unchanged days are kept
+    with open(tmp_path, 'r') as fp:
+        assert fp.read() == ('2015-01-01 08:00: Arrived.\n'
+                             '2015-01-01 09:00: Timeflow: start project\n'
+                             '\n'
+                             '\n'
+                             '2015-01-02 08:00: Arrived.\n'
+                             '2015-01-02 08:30: Breakfast **\n'
+                             '2015-01-02 09:00: Timeflow: sync\n'
+                             '\n'
+                             '2015-01-03 08:00: Arrived.\n'
+                             '\n'
+                             '2015-01-04 08:00: Arrived.\n')
+    with open(other_path, 'r') as fp:
+        assert fp.read().replace('\n\n', '\n') == (
+            '2015-01-01 08:00: Arrived.\n'
+            '2015-01-01 09:00: Timeflow: start project\n'
+            '2015-01-02 08:00: Arrived.\n'
+            '2015-01-02 08:30: Breakfast **\n'
+            '2015-01-02 09:00: Timeflow: sync\n'
+            '2015-01-03 08:00: Arrived.\n'
+            '2015-01-04 08:00: Arrived.\n'
+        )
+
+    # day blocks of rewritten logs are kept, so they are not hashed again,
+    # and only the last day and appended days are hashed
+    hashed = []
+    hash_blocks = timeflow.sync.hash_blocks
+
+    def record_hash_blocks(buf, start=0):
+        hashed.append(buf[start:].decode('utf-8'))
+        return hash_blocks(buf, start)
+    monkeypatch.setattr(timeflow.sync, 'hash_blocks', record_hash_blocks)
+    for path in (tmp_path, other_path):
+        with open(path, 'rb') as fp:
+            blocks = [tuple(block) for block in hash_blocks(fp.read())]
+        assert timeflow.sync.get_day_blocks(path) == blocks
+    assert hashed == []
+
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-04 09:00: Timeflow: release\n')
+    args = parser.parse_args(['sync', other_path])
+    args.func(args)
+    assert hashed == ['2015-01-04 08:00: Arrived.\n'
+                      '2015-01-04 09:00: Timeflow: release\n']
+    args = parser.parse_args(['sync', other_path])
+    args.func(args)
+    monkeypatch.undo()
+
+    out, err = capsys.readouterr()
+    assert out == ("Merged 1 days, added 0 lines to the log and 1 lines to "
+                   "the other log\n"
+                   "Logs are in sync\n")
+
+    # log changed by other program, while logs are merged, is left as it is
+    append_while_rewritten(monkeypatch,
+                           '2015-01-04 10:00: Timeflow: merge\n')
+    with open(other_path, 'a') as fp:
+        fp.write('2015-01-04 09:30: Timeflow: review\n')
+    args = parser.parse_args(['sync', other_path])
+    with pytest.raises(SystemExit):
+        args.func(args)
+    with open(tmp_path, 'r') as fp:
+        assert fp.read().endswith('2015-01-04 10:00: Timeflow: merge\n')
+
+
+def test_compact(tmpdir, capsys, monkeypatch):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    timeflow.utils.LOG_FILE = tmp_path
+
+    with open(tmp_path, 'w') as fp:
+        fp.write('2015-01-01 08:00: Arrived.\n'
+                 '2015-01-01 08:05: Arrived.\n'
+                 '2015-01-01 09:00: Timeflow: heartbeat\n'
+                 '2015-01-01 09:05: Timeflow: heartbeat\n'
+                 '2015-01-01 09:10: Timeflow: heartbeat\n'
+                 '2015-01-01 09:30: Slack: break **\n'
+                 '2015-01-01 09:40: Slack: break **\n'
+                 '\n'
+                 '2015-01-02 08:00: Arrived.\n'
+                 '2015-01-02 09:00: Timeflow: heartbeat\n'
+                 '2015-01-02 09:05: Timeflow: heartbeat\n')
+    lines = timeflow.utils.read_log_file_lines()
+    report = stats.calculate_report(lines, '2015-01-01', '2015-01-02')
+
+    # run compact command
+    parser = cli.create_parser()
+    args = parser.parse_args(['compact', '--before', '2015-01-02'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == "Removed 3 lines, saved 110 bytes\n"
+
+    # the first entry of the day is kept, as times are counted from it
+    with open(tmp_path, 'r') as fp:
+        assert fp.read() == ('2015-01-01 08:00: Arrived.\n'
+                             '2015-01-01 08:05: Arrived.\n'
+                             '2015-01-01 09:10: Timeflow: heartbeat\n'
+                             '2015-01-01 09:40: Slack: break **\n'
+                             '\n'
+                             '2015-01-02 08:00: Arrived.\n'
+                             '2015-01-02 09:00: Timeflow: heartbeat\n'
+                             '2015-01-02 09:05: Timeflow: heartbeat\n')
+    lines = timeflow.utils.read_log_file_lines()
+    assert stats.calculate_report(lines, '2015-01-01', '2015-01-02') == report
+
+    # log changed by other program, while it's compacted, is left as it is
+    append_while_rewritten(monkeypatch,
+                           '2015-01-02 09:10: Timeflow: heartbeat\n')
+    args = parser.parse_args(['compact'])
+    with pytest.raises(SystemExit) as e:
+        args.func(args)
+    assert 'has changed' in str(e.value)
+    with open(tmp_path, 'r') as fp:
+        assert fp.read().endswith('2015-01-02 09:05: Timeflow: heartbeat\n'
+                                  '2015-01-02 09:10: Timeflow: heartbeat\n')
+
+
+def test_snapshot(tmpdir, monkeypatch):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # copy fake log, as it is going to be changed
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(test_dir + '/fake_log.txt') as src, open(tmp_path, 'w') as dst:
+        dst.write(src.read())
+    timeflow.utils.LOG_FILE = tmp_path
+
+    def assert_same_as_text_log(entries):
+        lines = timeflow.utils.read_log_file_lines()
+        assert len(entries) == len(lines)
+        for date_from, date_to in [('2014-12-24', '2015-01-02'),
+                                   ('2015-01-01', '2015-01-01'),
+                                   ('2015-01-02', '2015-01-05')]:
+            assert (
+                stats.calculate_entries_stats(entries, date_from, date_to) ==
+                stats.calculate_stats(lines, date_from, date_to)
+            )
+            assert (
+                stats.calculate_entries_report(entries, date_from, date_to) ==
+                stats.calculate_report(lines, date_from, date_to)
+            )
+
+    entries = timeflow.snapshot.update_snapshot()
+    assert_same_as_text_log(entries)
+
+    # unchanged log is not parsed again, columns are memory mapped
+    entries = timeflow.snapshot.update_snapshot()
+    assert isinstance(entries.minutes, memoryview)
+    assert_same_as_text_log(entries)
+
+    # only appended lines are parsed, incomplete line is parsed again
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:00: Work: review')
+    entries = timeflow.snapshot.update_snapshot()
+    assert entries.partial
+    with open(tmp_path, 'a') as fp:
+        fp.write(' **\n')
+    entries = timeflow.snapshot.update_snapshot()
+    assert not entries.partial
+    assert entries.log_names[entries.logs[-1]] == 'review'
+    assert entries.slack[-1] == 1
+    assert_same_as_text_log(entries)
+
+    # only appended entries and strings are written into snapshot in place
+    snapshot_file = timeflow.snapshot.get_snapshot_file(tmp_path)
+    inode = os.stat(snapshot_file).st_ino
+    written_rows = []
+    write_rows = timeflow.snapshot._write_rows
+
+    def record_write_rows(fp, entries, offsets, start):
+        written_rows.append(len(entries) - start)
+        return write_rows(fp, entries, offsets, start)
+    monkeypatch.setattr(timeflow.snapshot, '_write_rows', record_write_rows)
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 15:00: Work: merge\n')
+    timeflow.snapshot.update_snapshot()
+    assert written_rows == [1]
+    assert os.stat(snapshot_file).st_ino == inode
+    entries = timeflow.snapshot.load_snapshot(tmp_path)
+    assert entries.log_names[entries.logs[-1]] == 'merge'
+    assert_same_as_text_log(entries)
+
+    # edited log is parsed again, snapshot is written anew
+    monkeypatch.setattr(timeflow.snapshot, 'MIN_CAPACITY', 0)
+    with open(tmp_path, 'r') as fp:
+        content = fp.read()
+    with open(tmp_path, 'w') as fp:
+        fp.write(content.replace('2015-01-02 12:00', '2015-01-02 12:30'))
+    entries = timeflow.snapshot.update_snapshot()
+    assert written_rows == [1, len(entries)]
+    assert_same_as_text_log(entries)
+
+    # snapshot without room for appended entries is written anew
+    with open(tmp_path, 'a') as fp:
+        for hour in range(16, 24):
+            fp.write('2015-01-02 {}:00: Work: merge\n'.format(hour))
+    entries = timeflow.snapshot.update_snapshot()
+    assert written_rows == [1, len(entries) - 8, len(entries)]
+    assert_same_as_text_log(timeflow.snapshot.load_snapshot(tmp_path))
+
+
+def test_binary_log(patch_datetime_now, tmpdir, capsys, monkeypatch):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(test_dir + '/fake_log.txt') as fp:
+        text_log = fp.read()
+
+    # copy fake log, as it is going to be converted
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(tmp_path, 'w') as fp:
+        fp.write(text_log)
+    timeflow.utils.LOG_FILE = tmp_path
+    parser = cli.create_parser()
+
+    text_stats = {}
+    for date_range in (['--this-week'], ['--last-week'], ['--day', '2015-01-02']):
+        args = parser.parse_args(['stats', '-r'] + date_range)
+        args.func(args)
+        text_stats[tuple(date_range)], err = capsys.readouterr()
+
+    args = parser.parse_args(['import-text'])
+    args.func(args)
+    out, err = capsys.readouterr()
+    assert out == "Imported 21 entries into binary log\n"
+    assert timeflow.binlog.is_binary_log(tmp_path)
+
+    for date_range, result in text_stats.items():
+        args = parser.parse_args(['stats', '-r'] + list(date_range))
+        args.func(args)
+        out, err = capsys.readouterr()
+        assert out == result
+
+    # editing through text rendering keeps the log as it is
+    args = parser.parse_args(['edit', '-e', 'true'])
+    args.func(args)
+
+    # entries are appended, separated from the previous day
+    args = parser.parse_args(['log', 'Timeflow: binary log'])
+    args.func(args)
+    args = parser.parse_args(['export-text'])
+    args.func(args)
+    out, err = capsys.readouterr()
+    assert out == text_log + '\n2015-01-01 23:59: Timeflow: binary log\n'
+
+    # strings, which are in the string table, are not stored again, and
+    # only appended records are read into entries
+    strings_file, = tmpdir.listdir(lambda path: path.ext == '.strings')
+    strings_size = strings_file.size()
+    with open(tmp_path, 'rb') as fp:
+        entries = timeflow.binlog.read_binary_entries(fp)
+    args = parser.parse_args(['log', 'Timeflow: binary log'])
+    args.func(args)
+    assert strings_file.size() == strings_size
+    with open(tmp_path, 'rb') as fp:
+        entries = timeflow.binlog.read_binary_entries(fp, entries.copy())
+        all_entries = timeflow.binlog.read_binary_entries(fp)
+    assert len(entries) == 23
+    assert ([entries.line(i).__dict__ for i in range(len(entries))] ==
+            [all_entries.line(i).__dict__ for i in range(len(entries))])
+    begin, end = all_entries.date_range('2015-01-02', '2015-01-02')
+    entries = timeflow.binlog.read_date_range_entries(tmp_path, '2015-01-02',
+                                                      '2015-01-02')
+    assert begin < end
+    assert ([entries.line(i).__dict__ for i in range(len(entries))] ==
+            [all_entries.line(i).__dict__ for i in range(begin, end)])
+
+    with pytest.raises(SystemExit):
+        args = parser.parse_args(['search', 'binary'])
+        args.func(args)
+
+    bad_path = tmpdir.join("bad_log.txt").strpath
+    with open(bad_path, 'w') as fp:
+        fp.write('2015-01-01 08:00: Arrived.\n'
+                 '2015-01-01 9:00: Timeflow: start project\n')
+    with pytest.raises(SystemExit) as e:
+        args = parser.parse_args(['import-text', bad_path])
+        args.func(args)
+    assert str(e.value).startswith("Line 2: ")
+
+    # entries appended, while log is edited, are not lost
+    edit_file = cli._edit_file
+
+    def append_and_edit_file(args, path):
+        timeflow.binlog.append_line(tmp_path, '2015-01-01 23:30: Edited.\n')
+        edit_file(args, path)
+    monkeypatch.setattr(cli, '_edit_file', append_and_edit_file)
+    args = parser.parse_args(['edit', '-e', 'true'])
+    with pytest.raises(SystemExit) as e:
+        args.func(args)
+    assert 'edited log is kept in' in str(e.value)
+    os.remove(str(e.value).rsplit(' ', 1)[1])
+    lines = list(timeflow.binlog.iter_text_lines(tmp_path))
+    assert lines[-1] == '2015-01-01 23:30: Edited.\n'
+    assert len(tmpdir.listdir(lambda path: path.ext == '.strings')) == 1
+
+
+def test_entry_view():
+    data = (b'2015-01-02 10:25: Slack: break **\r\n'
+            b'2015-01-02 13:05: Lunch **\n'
+            b'\n'
+            b'2015-01-02 14:00: Work: task: #42\n'
+            b'2015-01-02 1')
+    views = [timeflow.views.EntryView(data, start, end)
+             for start, end, _ in timeflow.views.iter_line_bounds(data)]
+    assert len(views) == 4
+    assert views[0].minutes == timeflow.utils.get_epoch_minutes('2015-01-02',
+                                                                '10:25')
+    assert (views[0].project, views[0].log, views[0].is_slack) == (
+        'Slack', 'break', True)
+    assert (views[1].project, views[1].log, views[1].is_slack) == (
+        'Lunch', '', True)
+    # raw strings are looked up in dict of bytes without copying them
+    assert {b'Slack': 1}.get(views[0].project_view) == 1
+    assert views[1].log_view == b''
+    assert views[2].line().__dict__ == {
+        'date': '2015-01-02', 'time': '14:00', 'project': 'Work',
+        'log': 'task: #42', 'is_slack': False,
+    }
+
+    # incomplete last line is parsed, when it's complete
+    entries = timeflow.entries.Entries()
+    entries.append_data(data)
+    assert len(entries) == 3 and not entries.partial
+    assert entries.size == data.rindex(b'\n') + 1
+
+
+def test_report_records_spilled(tmpdir):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+    entries = timeflow.snapshot.update_snapshot()
+
+    work_report, slack_report = stats.calculate_entries_report(
+        entries, '2014-12-24', '2015-01-02'
+    )
+    # only 2 logs are summed up in memory, the rest are spilled to disk
+    work_records, slack_records = stats.calculate_entries_report_records(
+        entries, '2014-12-24', '2015-01-02', limit=2
+    )
+    assert (
+        stats.create_full_records_report(work_records, slack_records) ==
+        stats.create_full_report(work_report, slack_report)
+    )
+
+    work_records, _ = stats.calculate_entries_report_records(
+        entries, '2014-12-24', '2015-01-02', limit=2
+    )
+    assert (
+        stats.create_records_report_as_gtimelog(work_records) ==
+        stats.create_report_as_gtimelog(work_report)
+    )
+
+
+def test_stats_compare(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats', '--this-week', '--compare', 'last-week',
+                              '--filter-projects', 'Timeflow,Pytest,Slack'])
+    args.func(args)
+
+    # extract STDOUT, as stats command prints to it
+    out, err = capsys.readouterr()
+    result = (
+        "                        2014-12-29 - 2015-01-04   2014-12-22 - 2014-12-28   Change\n"
+        "Work                    2 hours 5 min             1 hour 35 min             +30 min\n"
+        "Slack                   1 hour 15 min             25 min                    +50 min\n"
+        "\n"
+        "Work by project:\n"
+        "Pytest                  0 min                     1 hour 35 min             -1 hour 35 min\n"
+        "Timeflow                2 hours 5 min             0 min                     +2 hours 5 min\n"
+        "\n"
+        "Slack by project:\n"
+        "Slack                   1 hour 15 min             25 min                    +50 min\n"
+    )
+    assert out == result
+
+
+def test_stats_ranges(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats',
+                              '--range', '2014-12-24:2014-12-24',
+                              '--range', '2014-12-24:2015-01-01',
+                              '--exclude-projects', 'Slack,Breakfast'])
+    args.func(args)
+
+    # extract STDOUT, as stats command prints to it
+    out, err = capsys.readouterr()
+    result = (
+        "                        2014-12-24                2014-12-24 - 2015-01-01   Change\n"
+        "Work                    2 hours 50 min            8 hours 30 min            -5 hours 40 min\n"
+        "Slack                   0 min                     0 min                     0 min\n"
+        "\n"
+        "Work by project:\n"
+        "Books                   0 min                     1 hour 35 min             -1 hour 35 min\n"
+        "Christmas               1 hour 15 min             1 hour 15 min             0 min\n"
+        "Django                  0 min                     1 hour 35 min             -1 hour 35 min\n"
+        "New-year                0 min                     1 hour 15 min             -1 hour 15 min\n"
+        "Pytest                  1 hour 35 min             1 hour 35 min             0 min\n"
+        "Timeflow                0 min                     1 hour 15 min             -1 hour 15 min\n"
+    )
+    assert out == result
+
+
+def test_log_api(patch_datetime_now, tmpdir):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # copy fake log, as it is going to be changed
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(test_dir + '/fake_log.txt') as src, open(tmp_path, 'w') as dst:
+        dst.write(src.read())
+
+    log = timeflow.Log(tmp_path)
+    work_time, slack_time, today_work_time = log.stats(
+        '2015-01-01', '2015-01-01', exclude_projects=['Django']
+    )
+    assert (sum(work_time), sum(slack_time)) == (75 * 60, 70 * 60)
+    assert today_work_time is None
+
+    work_report, slack_report = log.report('2015-01-01', '2015-01-01')
+    assert work_report == {'Django': {'read documentation': 95 * 60},
+                           'Timeflow': {'start project': 75 * 60}}
+
+    entries = log.entries('2015-01-02', '2015-01-02')
+    assert len(entries) == 6
+    line, seconds = entries[0]
+    assert (line.date, line.time, line.project, seconds) == \
+        ('2015-01-02', '08:25', 'Arrived.', None)
+    line, seconds = entries[-1]
+    assert (line.project, line.log, line.is_slack, seconds) == \
+        ('Lunch', '', True, 65 * 60)
+
+    assert not log.refresh()
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:00: Work: review\n')
+    assert log.refresh()
+    line, seconds = log.entries('2015-01-02', '2015-01-02')[-1]
+    assert (line.project, line.log, seconds) == ('Work', 'review', 55 * 60)
+
+    # today's working time is counted up to given time
+    work_time, slack_time, today_work_time = log.stats(
+        now=datetime.datetime(2015, 1, 1, 12, 0)
+    )
+    assert today_work_time == 4 * 3600
+
+    # today is the date of given time
+    work_time, slack_time, today_work_time = log.stats(
+        now=datetime.datetime(2015, 1, 2, 15, 0)
+    )
+    assert (sum(work_time), today_work_time) == (245 * 60, 395 * 60)
+    assert len(log.entries(now=datetime.datetime(2015, 1, 2, 15, 0))) == 7
+
+    # hash of appended bytes is chained to the hash of the parsed ones,
+    # incomplete last line is parsed again, when it's complete
+    size, log_hash = log.fingerprint().split('-')
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:30: Work: tests')
+    assert log.refresh()
+    assert log.fingerprint() == '{}-{}'.format(size, log_hash)
+    with open(tmp_path, 'a') as fp:
+        fp.write('\n2015-01-02 15:00: Work: commit\n')
+    assert log.refresh()
+    with open(tmp_path, 'rb') as fp:
+        data = fp.read()
+    assert log.fingerprint() == '{}-{}'.format(
+        len(data),
+        timeflow.entries.chain_hash(bytes.fromhex(log_hash),
+                                    data[int(size):]).hex(),
+    )
+    line, seconds = log.entries('2015-01-02', '2015-01-02')[-2]
+    assert (line.project, line.log, seconds) == ('Work', 'tests', 30 * 60)
+
+
+def edit_in_place(path, old, new):
+    "Replaces bytes of the file in place, so that its size doesn't change"
+    stat = os.stat(path)
+    with open(path, 'r+b') as fp:
+        offset = fp.read().index(old)
+        fp.seek(offset)
+        fp.write(new)
+    # edit may be done within resolution of modification time
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    return offset
+
+
+def test_log_edited_in_place(tmpdir):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    write_synthetic_log(tmp_path, SYNTHETIC_LOG_LINES)
+    log = timeflow.Log(tmp_path)
+    work_time, slack_time, _ = log.stats('2015-02-22', '2015-02-22')
+
+    # time of the last entry of the day is fixed far from the beginning and
+    # the end of the log file
+    offset = edit_in_place(tmp_path, b'2015-02-22 23:30', b'2015-02-22 23:45')
+    assert timeflow.utils.CHECK_WINDOW < offset
+    assert offset < os.path.getsize(tmp_path) - timeflow.utils.CHECK_WINDOW
+    assert log.refresh()
+    stats_after_edit = log.stats('2015-02-22', '2015-02-22')
+    assert (sum(stats_after_edit[0]) + sum(stats_after_edit[1]) ==
+            sum(work_time) + sum(slack_time) + 15 * 60)
+    assert stats_after_edit == timeflow.Log(tmp_path).stats('2015-02-22',
+                                                            '2015-02-22')
+
+
+def test_serve(tmpdir, monkeypatch):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    now = [FAKE_TIME]
+
+    class mydatetime(datetime.datetime):
+        @classmethod
+        def now(cls):
+            return now[0]
+
+    monkeypatch.setattr(datetime, 'datetime', mydatetime)
+
+    server = timeflow.server.create_server('127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        response = urllib.request.urlopen(
+            url + '/stats?from=2015-01-01&to=2015-01-01'
+            '&exclude_projects=Django,Slack'
+        )
+        assert json.loads(response.read().decode('utf-8')) == {
+            'work_time': [75 * 60],
+            'slack_time': [45 * 60],
+            'today_work_time': None,
+        }
+        etag = response.headers['ETag']
+
+        # unchanged result is not sent again
+        request = urllib.request.Request(
+            url + '/stats?from=2015-01-01&to=2015-01-01'
+            '&exclude_projects=Django,Slack',
+            headers={'If-None-Match': etag},
+        )
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(request)
+        assert e.value.code == 304
+
+        request = urllib.request.Request(
+            url + '/entries?from=2014-12-24&to=2015-01-02',
+            headers={'Accept-Encoding': 'gzip'},
+        )
+        response = urllib.request.urlopen(request)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert response.headers['ETag'].endswith('-gzip"')
+        entries = json.loads(gzip.decompress(response.read()).decode('utf-8'))
+        assert len(entries) == 21
+        assert entries[-1] == {'date': '2015-01-02', 'time': '13:05',
+                               'project': 'Lunch', 'log': '',
+                               'is_slack': True, 'seconds': 65 * 60}
+
+        response = urllib.request.urlopen(
+            url + '/report?from=2015-01-01&to=2015-01-01'
+        )
+        assert json.loads(response.read().decode('utf-8'))['slack'] == {
+            'Breakfast': {'': 45 * 60},
+            'Slack': {'watch YouTube': 25 * 60},
+        }
+
+        # range from today is other range, when the date changes
+        response = urllib.request.urlopen(url + '/entries?to=2015-01-02')
+        assert len(json.loads(response.read().decode('utf-8'))) == 11
+        request = urllib.request.Request(
+            url + '/entries?to=2015-01-02',
+            headers={'If-None-Match': response.headers['ETag']},
+        )
+        now[0] = datetime.datetime(2015, 1, 2, 0, 1)
+        response = urllib.request.urlopen(request)
+        assert len(json.loads(response.read().decode('utf-8'))) == 6
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_stats_watcher(tmpdir, monkeypatch):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # copy fake log, as it is going to be changed
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(test_dir + '/fake_log.txt') as src, open(tmp_path, 'w') as dst:
+        dst.write(src.read())
+
+    watcher = timeflow.watch.StatsWatcher(tmp_path, '2015-01-02', '2015-01-02',
+                                          exclude_projects=['Lunch'])
+    assert watcher.update()
+    assert (watcher.work_time, watcher.slack_time) == (190 * 60, 25 * 60)
+    assert not watcher.update()
+
+    # appended entries are added to totals, without counting them again
+    read_log_entries = timeflow.watch.read_log_entries
+    parsed = []
+
+    def record_read_entries(fp, entries):
+        parsed.append(entries.size)
+        return read_log_entries(fp, entries)
+    monkeypatch.setattr(timeflow.watch, 'read_log_entries',
+                        record_read_entries)
+
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:00: Work: review\n'
+                 '2015-01-02 14:10: Lunch **\n'
+                 '2015-01-02 14:30: Slack: coffee')
+    assert watcher.update()
+    assert (watcher.work_time, watcher.slack_time) == (245 * 60, 25 * 60)
+    with open(tmp_path, 'a') as fp:
+        fp.write(' **\n')
+    assert watcher.update()
+    assert (watcher.work_time, watcher.slack_time) == (245 * 60, 45 * 60)
+    assert watcher.today_work_time(
+        now=datetime.datetime(2015, 1, 2, 15, 25)
+    ) == 7 * 3600
+
+    # rewritten log is counted again
+    with open(tmp_path, 'r') as fp:
+        content = fp.read()
+    with open(tmp_path, 'w') as fp:
+        fp.write(content.replace('2015-01-02 14:00', '2015-01-02 13:30'))
+    assert watcher.update()
+    assert (watcher.work_time, watcher.slack_time) == (215 * 60, 45 * 60)
+    assert len(parsed) == 3
+
+
+def test_stats_watcher_where(tmpdir):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # copy fake log, as it is going to be changed
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(test_dir + '/fake_log.txt') as src, open(tmp_path, 'w') as dst:
+        dst.write(src.read())
+
+    # warm snapshot is memory mapped, its columns are replaced on append
+    timeflow.snapshot.update_snapshot(tmp_path)
+    where = timeflow.query.Query('hour >= 10 and project != Lunch')
+    watcher = timeflow.watch.StatsWatcher(tmp_path, '2015-01-02', '2015-01-02',
+                                          where=where)
+    assert watcher.update()
+    assert isinstance(watcher.entries.minutes, memoryview)
+    assert (watcher.work_time, watcher.slack_time) == (140 * 60, 25 * 60)
+
+    with open(tmp_path, 'a') as fp:
+        fp.write('2015-01-02 14:00: Work: review\n'
+                 '2015-01-02 14:10: Slack: coffee **\n')
+    assert watcher.update()
+    assert (watcher.work_time, watcher.slack_time) == (195 * 60, 35 * 60)
+
+
+def test_stats_watcher_edited_in_place(tmpdir):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    write_synthetic_log(tmp_path, SYNTHETIC_LOG_LINES)
+    watcher = timeflow.watch.StatsWatcher(tmp_path, '2015-02-22', '2015-02-22')
+    assert watcher.update()
+    total_time = watcher.work_time + watcher.slack_time
+
+    # edited log is counted again, even if it has not grown
+    edit_in_place(tmp_path, b'2015-02-22 23:30', b'2015-02-22 23:45')
+    assert watcher.update()
+    assert watcher.work_time + watcher.slack_time == total_time + 15 * 60
+    fresh_watcher = timeflow.watch.StatsWatcher(tmp_path, '2015-02-22',
+                                                '2015-02-22')
+    fresh_watcher.update()
+    assert ((watcher.work_time, watcher.slack_time) ==
+            (fresh_watcher.work_time, fresh_watcher.slack_time))
+
+
+def test_wait_for_change(tmpdir):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    with open(tmp_path, 'w') as fp:
+        fp.write('2015-01-02 08:00: Arrived.\n')
+
+    def append():
+        with open(tmp_path, 'a') as fp:
+            fp.write('2015-01-02 09:00: Timeflow: watch\n')
+
+    for inotify_fd in (timeflow.watch.inotify_watch(tmp_path), None):
+        timer = threading.Timer(0.1, append)
+        timer.start()
+        assert timeflow.watch.wait_for_change(tmp_path, 5, inotify_fd)
+        timer.join()
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+    assert not timeflow.watch.wait_for_change(tmp_path, 0.1)
+
+    # change made after file was read is not waited for
+    stat_key = timeflow.watch._stat_key(tmp_path)
+    append()
+    assert timeflow.watch.wait_for_change(tmp_path, 60, stat_key=stat_key)
+
+
+def test_stats_rolling(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats', '--from', '2014-12-31',
+                              '--to', '2015-01-02',
+                              '--rolling', '2', '--rolling', '7'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    result = (
+        "Date             Work 2d    Slack 2d     Work 7d    Slack 7d\n"
+        "2014-12-31           2.8         1.2         2.8         1.2\n"
+        "2015-01-01           5.7         2.3         5.7         2.3\n"
+        "2015-01-02           6.0         2.7         8.8         3.8\n"
+    )
+    assert out == result
+
+    # days before the date range are counted in the windows
+    args = parser.parse_args(['stats', '--day', '2015-01-02',
+                              '--rolling', '2', '--format', 'csv'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == ("date,work_2d,slack_2d\n"
+                   "2015-01-02,21600,9600\n")
+
+    # windows longer than the log are counted from its first entry
+    args = parser.parse_args(['stats', '--day', '2015-01-02',
+                              '--rolling', '1000000000', '--format', 'csv'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == ("date,work_1000000000d,slack_1000000000d\n"
+                   "2015-01-02,42000,18000\n")
+
+    # output format is only for rolling stats
+    with pytest.raises(SystemExit):
+        args = parser.parse_args(['stats', '--day', '2015-01-02',
+                                  '--format', 'csv'])
+        args.func(args)
+
+
+def test_top(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run top command
+    parser = cli.create_parser()
+    args = parser.parse_args(['top', '-k', '2', '--this-week'])
+    args.func(args)
+
+    # extract STDOUT, as top command prints to it
+    out, err = capsys.readouterr()
+    result = (
+        "Work: 8 hours 50 min\n"
+        "    2 hours 20 min    26.4%  Work\n"
+        "    2 hours 5 min     23.6%  Timeflow\n"
+        "\n"
+        "Slack: 3 hours 50 min\n"
+        "    1 hour 30 min     39.1%  Breakfast\n"
+        "    1 hour 15 min     32.6%  Slack\n"
+    )
+    assert out == result
+
+
+def test_top_by_log(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run top command
+    parser = cli.create_parser()
+    args = parser.parse_args(['top', '--by', 'log', '-k', '1',
+                              '--day', '2015-01-02',
+                              '--exclude-projects', 'Lunch'])
+    args.func(args)
+
+    # extract STDOUT, as top command prints to it
+    out, err = capsys.readouterr()
+    result = (
+        "Work: 3 hours 10 min\n"
+        "    1 hour 35 min     50.0%  Work: working on task #42\n"
+        "\n"
+        "Slack: 25 min\n"
+        "    0 hours 25 min   100.0%  Slack: break\n"
+    )
+    assert out == result
+
+
+def test_top_zero_time(tmpdir, capsys):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    timeflow.utils.LOG_FILE = tmp_path
+    with open(tmp_path, 'w') as fp:
+        fp.write('2015-01-02 08:00: Arrived.\n'
+                 '2015-01-02 08:00: Timeflow: top\n')
+
+    # run top command
+    parser = cli.create_parser()
+    args = parser.parse_args(['top', '--day', '2015-01-02'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == ("Work: 0 min\n"
+                   "    0 hours 0 min      0.0%  Timeflow\n"
+                   "\n"
+                   "Slack: 0 min\n")
+
+
+# peak memory budgets in bytes per million log lines
+MEMORY_BUDGETS = {
+    'read_log_file_lines': 160 * 1024 * 1024,
+    'parse_lines': 640 * 1024 * 1024,
+    'calculate_stats': 80 * 1024 * 1024,
+    'calculate_report': 48 * 1024 * 1024,
+    'create_full_report': 32 * 1024 * 1024,
+    'create_report_as_gtimelog': 16 * 1024 * 1024,
+    # stats and reports of the CLI are made from entries of the snapshot
+    'update_snapshot': 144 * 1024 * 1024,
+    'calculate_entries_stats': 64 * 1024 * 1024,
+    'calculate_entries_report_records': 64 * 1024 * 1024,
+    'create_full_records_report': 48 * 1024 * 1024,
+    'create_records_report_as_gtimelog': 32 * 1024 * 1024,
+}
+SYNTHETIC_LOG_LINES = 5000
+
+
+def write_synthetic_log(path, lines_count):
+    "Writes log of 20 projects with 500 logs, every 7th of them is slack"
+    time = datetime.datetime(2015, 1, 1, 8, 0)
+    with open(path, 'w') as fp:
+        for i in range(lines_count):
+            fp.write('{}: Project{}: task #{}{}\n'.format(
+                time.strftime(timeflow.utils.DATETIME_FORMAT),
+                i % 20, i % 500, ' **' if i % 7 == 0 else '',
+            ))
+            time += datetime.timedelta(minutes=30)
+
+
+def test_memory_budgets(tmpdir):
+    tmp_path = tmpdir.join("test_log.txt").strpath
+    write_synthetic_log(tmp_path, SYNTHETIC_LOG_LINES)
+    timeflow.utils.LOG_FILE = tmp_path
+    date_from, date_to = '2015-01-01', '2016-12-31'
+
+    peaks = {}
+
+    def measure(func, *args):
+        result, peak, _ = timeflow.debug.trace_memory(func, *args)
+        peaks[func.__name__] = peak
+        return result
+
+    lines = measure(timeflow.utils.read_log_file_lines)
+    measure(timeflow.utils.parse_lines)
+    measure(stats.calculate_stats, lines, date_from, date_to)
+    work_report, slack_report = measure(stats.calculate_report,
+                                        lines, date_from, date_to)
+    measure(stats.create_full_report, work_report, slack_report)
+    measure(stats.create_report_as_gtimelog, work_report)
+
+    # snapshot is made from scratch, as the first stats command does it
+    entries = measure(timeflow.snapshot.update_snapshot)
+    measure(stats.calculate_entries_stats, entries, date_from, date_to)
+    work_records, slack_records = measure(
+        stats.calculate_entries_report_records, entries, date_from, date_to
+    )
+    measure(stats.create_full_records_report, work_records, slack_records)
+    work_records, _ = stats.calculate_entries_report_records(
+        entries, date_from, date_to
+    )
+    measure(stats.create_records_report_as_gtimelog, work_records)
+
+    for name, budget in MEMORY_BUDGETS.items():
+        peak_per_million = peaks[name] * 1000000 // SYNTHETIC_LOG_LINES
+        assert peak_per_million <= budget, name
+
+
+def test_debug_memory(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # run debug memory command
+    parser = cli.create_parser()
+    args = parser.parse_args(['debug', 'memory', '--this-week', '-r',
+                              '-n', '3'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[0].startswith("Peak memory: ")
+    assert lines[1] == "Top allocation sites:"
+    assert 2 <= len(lines) <= 5
+
+
+def test_stats_where(patch_datetime_now, capsys):
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # overwrite log file setting, to define file to be used in tests
+    timeflow.utils.LOG_FILE = test_dir + '/fake_log.txt'
+
+    # compiled queries give the same results for raw lines and for entries
+    lines = timeflow.utils.read_log_file_lines()
+    entries = timeflow.snapshot.update_snapshot()
+    for expression in ['slack',
+                       'not slack and hour < 10',
+                       'weekday in (wed, Thursday) or project == Work',
+                       'log ~ "task #\\d+" and minute != 0',
+                       'date >= 2014-12-31 and (project = Slack or work)']:
+        where = timeflow.query.Query(expression)
+        assert (
+            stats.calculate_entries_stats(entries, '2014-12-24',
+                                          '2015-01-02', where=where) ==
+            stats.calculate_stats(lines, '2014-12-24', '2015-01-02',
+                                  where=where)
+        )
+        assert (
+            stats.calculate_entries_report(entries, '2014-12-24',
+                                           '2015-01-02', where=where) ==
+            stats.calculate_report(lines, '2014-12-24', '2015-01-02',
+                                   where=where)
+        )
+
+    # run stats command
+    parser = cli.create_parser()
+    args = parser.parse_args(['stats', '--day', '2015-01-02', '--report',
+                              '--where', 'log ~ "task #\\d+"'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    result = (
+        "------------------------------ WORK -------------------------------\n"
+        "Work:\n"
+        "    0 hours 45 min: finish task #115\n"
+        "    1 hour 35 min: working on task #42\n"
+        "    Total: 2 hours 20 min\n"
+        "------------------------------ SLACK ------------------------------\n"
+        "\n"
+    )
+    assert out == result
+
+    args = parser.parse_args(['stats', '--day', '2015-01-02',
+                              '--where', 'hour >= 10 and not slack'])
+    args.func(args)
+
+    out, err = capsys.readouterr()
+    assert out == ("Work: 2 hours 20 min\n"
+                   "Slack: 0 min\n")
+
+    for expression in ['hour >= 24', 'log ~ "("', 'weekday = sat or']:
+        args = parser.parse_args(['stats', '--where', expression])
+        with pytest.raises(SystemExit) as e:
+            args.func(args)
+        assert str(e.value).startswith("Invalid query: ")
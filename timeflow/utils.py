@@ -1,17 +1,33 @@
 import calendar
+import contextlib
 import datetime as dt
+import functools
+import hashlib
 import os
 import re
 import sys
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # SETTINGS
 LOG_FILE = os.path.expanduser('~') + '/.timeflow'
+CACHE_DIR = os.path.expanduser('~') + '/.cache/timeflow'
 DATETIME_FORMAT = "%Y-%m-%d %H:%M"
 DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%H:%M"
 # length of date string
 DATE_LEN = 10
 # length of datetime string
 DATETIME_LEN = 16
+MINUTES_IN_DAY = 24 * 60
+SECONDS_IN_DAY = MINUTES_IN_DAY * 60
+EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+# number of bytes at the beginning and at the end of the read part of the
+# log file, which are compared to tell that log was only appended to
+CHECK_WINDOW = 64 * 1024
 
 
 def write_to_log_file(message):
@@ -23,10 +39,147 @@ def write_to_log_file(message):
     log_message = form_log_message(message)
     if not os.path.exists(os.path.dirname(LOG_FILE)):
         os.makedirs(os.path.dirname(LOG_FILE))
-    with open(LOG_FILE, 'a') as fp:
+    with locked_file(LOG_FILE, 'a') as fp:
         fp.write(log_message)
 
 
+@contextlib.contextmanager
+def locked_file(path, mode):
+    """
+    Opens file and holds exclusive lock on it, until it's closed
+
+    If file was replaced, while waiting for the lock, new file is opened
+    and locked, so nothing is written into the replaced file. Locking is
+    skipped, where `fcntl` is not available.
+    """
+    while True:
+        fp = open(path, mode)
+        if fcntl is None:
+            break
+        try:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            if os.fstat(fp.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except OSError:
+            pass
+        except BaseException:
+            fp.close()
+            raise
+        fp.close()
+    try:
+        yield fp
+    finally:
+        fp.close()
+
+
+@contextlib.contextmanager
+def rewrite_file(path, stat=None):
+    """
+    Locks file and yields name of temporary file, which replaces it
+    atomically, when the block is done
+
+    File is locked, so `log` command waits until it's rewritten. Other
+    programs may write to the file without locking it, so file is checked
+    to be unchanged before it's replaced, otherwise ValueError is raised
+    and file is left as it is. Temporary file is removed, if it's not used.
+
+    `stat`: stat of the file, which was read before it was locked, by
+    default file is expected to be unchanged since it's locked
+    """
+    with locked_file(path, 'rb') as fp:
+        if stat is None:
+            stat = os.fstat(fp.fileno())
+        with atomic_file(path) as tmp_file:
+            yield tmp_file
+            current_stat = os.stat(path)
+            if ((current_stat.st_ino, current_stat.st_size,
+                 current_stat.st_mtime_ns) !=
+                    (stat.st_ino, stat.st_size, stat.st_mtime_ns)):
+                raise ValueError("{} has changed, while it was rewritten, "
+                                 "it's left as it is".format(path))
+
+
+@contextlib.contextmanager
+def atomic_file(path):
+    """
+    Yields name of temporary file, which replaces file at `path` atomically,
+    when the block is done, so readers never see partially written file
+
+    Temporary file name has process id in it, so concurrent writers do not
+    write into the same file. It's removed, if the block fails.
+    """
+    tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        yield tmp_file
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def get_cache_file(log_file, suffix):
+    """
+    Returns path of the file in cache directory, which is unique for the
+    log file, e.g. its snapshot
+
+    Cache directory is created, if it doesn't exist yet.
+    """
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    log_hash = hashlib.sha1(os.path.abspath(log_file).encode('utf-8'))
+    return os.path.join(CACHE_DIR, log_hash.hexdigest() + suffix)
+
+
+def hash_windows(fp, size):
+    """
+    Returns SHA-1 hash of the first and of the last `CHECK_WINDOW` bytes of
+    the first `size` bytes of the file
+    """
+    windows_hash = hashlib.sha1()
+    fp.seek(0)
+    windows_hash.update(fp.read(min(size, CHECK_WINDOW)))
+    tail_start = max(CHECK_WINDOW, size - CHECK_WINDOW)
+    fp.seek(tail_start)
+    windows_hash.update(fp.read(max(0, size - tail_start)))
+    return windows_hash.hexdigest()
+
+
+def get_file_state(fp, size):
+    """
+    Returns dict of state of the file opened in binary mode, which first
+    `size` bytes were read, to tell later with `is_appended` if the file was
+    only appended to since then
+    """
+    stat = os.fstat(fp.fileno())
+    return {
+        'inode': stat.st_ino,
+        'file_size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'size': size,
+        'windows': hash_windows(fp, size),
+    }
+
+
+def is_appended(fp, state):
+    """
+    Returns True if the file opened in binary mode is unchanged or only
+    appended to since its `state` was got
+
+    File is taken as appended to, if it's the same file, it has grown and
+    the beginning and the end of its read part are unchanged. File, which
+    was modified, but has not grown, was edited in place, e.g. some time
+    was fixed, so it's not taken as appended to.
+    """
+    stat = os.fstat(fp.fileno())
+    if stat.st_ino != state['inode']:
+        return False
+    if (stat.st_size, stat.st_mtime_ns) == (state['file_size'],
+                                            state['mtime']):
+        return True
+    return (stat.st_size > state['file_size'] and
+            hash_windows(fp, state['size']) == state['windows'])
+
+
 def form_log_message(message):
     """
     Joins current time with the log message
@@ -88,6 +241,43 @@ def date_ends(lines, date_to_find):
     return find_date_line(lines, date_to_find, reverse=True)
 
 
+def _next_line_offset(data, offset):
+    "Returns offset of the first non empty line starting at or after `offset`"
+    if offset > 0 and data[offset - 1:offset] != b'\n':
+        offset = data.find(b'\n', offset)
+        offset = len(data) if offset == -1 else offset + 1
+    while data[offset:offset + 1] == b'\n':
+        offset += 1
+    return offset
+
+
+def find_date_offset(data, date_to_find, after=False):
+    """
+    Returns byte offset of the first line in `data`, which date is not less
+    than `date_to_find`, or greater than it if `after` is True
+
+    `data` is bytes (or mmap) of chronologically sorted log file. Line is
+    looked up using binary search, so only few lines are actually read.
+    """
+    date_to_find = date_to_find.encode('utf-8')
+    lo, hi = 0, len(data)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        offset = _next_line_offset(data, mid)
+        date = data[offset:offset + DATE_LEN]
+        if date and (date <= date_to_find if after else date < date_to_find):
+            lo = mid + 1
+        else:
+            hi = mid
+    return _next_line_offset(data, lo)
+
+
+def find_date_range_offsets(data, date_from, date_to):
+    "Returns byte offsets where lines from `date_from` to `date_to` begin and end"
+    return (find_date_offset(data, date_from),
+            find_date_offset(data, date_to, after=True))
+
+
 def get_time(seconds):
     hours = seconds // 3600
     minutes = seconds % 3600 // 60
@@ -119,6 +309,17 @@ def format_duration_long(seconds):
     return '%d hour%s %d min' % (h, h != 1 and "s" or "", m)
 
 
+def format_size(size):
+    "Formats number of bytes into human readable string"
+    if abs(size) < 1024:
+        return '%d B' % size
+    for unit in ['KiB', 'MiB']:
+        size /= 1024
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit)
+    return '%.1f GiB' % (size / 1024)
+
+
 def get_this_week():
     now = dt.datetime.now()
 
@@ -207,6 +408,34 @@ def get_last_month():
     return get_month_range(arg)
 
 
+def get_yesterday():
+    yesterday = dt.datetime.now() - dt.timedelta(days=1)
+    date = yesterday.strftime(DATE_FORMAT)
+    return date, date
+
+
+# date ranges, which can be compared using their names
+NAMED_RANGES = {
+    'yesterday': get_yesterday,
+    'this-week': get_this_week,
+    'last-week': get_last_week,
+    'this-month': get_this_month,
+    'last-month': get_last_month,
+}
+
+
+def parse_range_arg(arg):
+    "Returns date range from argument in form 'YYYY-MM-DD:YYYY-MM-DD'"
+    try:
+        date_from, date_to = arg.split(':')
+        dt.datetime.strptime(date_from, DATE_FORMAT)
+        dt.datetime.strptime(date_to, DATE_FORMAT)
+    except ValueError:
+        sys.exit('Argument in form of YYYY-MM-DD:YYYY-MM-DD is expected, '
+                 'e.g. 2015-01-01:2015-01-31')
+    return date_from, date_to
+
+
 class Line():
     def __init__(self, date, time, project, log, is_slack):
         self.date = date
@@ -261,6 +490,19 @@ def strip_log(string):
     return string.strip()
 
 
+def get_project(line):
+    """Returns project of a raw log line, stripped from slack marks
+
+    Only the project prefix is looked at, date and time are not parsed, so
+    lines can be rejected by project before doing any time parsing.
+    """
+    message = line[DATETIME_LEN + 2:]
+    project = message.split(': ', 1)[0]
+    if project and project[-1] == '\n':
+        project = project[:-1]
+    return strip_log(project)
+
+
 def parse_line(line):
     """Parses log line into logical units: time, project and message
 
@@ -298,6 +540,24 @@ def calc_time_diff(line, next_line):
     return (next_line_time - line_time).seconds
 
 
+@functools.lru_cache(maxsize=1024)
+def get_epoch_days(date):
+    "Returns number of days since epoch for date string"
+    year, month, day = date.split('-')
+    return dt.date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+
+
+def get_epoch_minutes(date, time):
+    "Returns number of minutes since epoch for date and time strings"
+    hours, minutes = time.split(':')
+    return (get_epoch_days(date) * MINUTES_IN_DAY +
+            int(hours) * 60 + int(minutes))
+
+
+def epoch_minutes_to_datetime(minutes):
+    return dt.datetime(1970, 1, 1) + dt.timedelta(minutes=minutes)
+
+
 def read_log_file_lines():
     with open(LOG_FILE, 'r') as fp:
         return [line for line in fp.readlines() if line != '\n']
@@ -0,0 +1,177 @@
+import datetime as dt
+import functools
+
+from timeflow.utils import DATE_LEN
+from timeflow.utils import DATETIME_LEN
+from timeflow.utils import EPOCH_ORDINAL
+from timeflow.utils import Line
+from timeflow.utils import MINUTES_IN_DAY
+from timeflow.utils import strip_log
+
+ZERO = ord('0')
+ASTERISK = ord('*')
+CARRIAGE_RETURN = ord('\r')
+SPACE = ord(' ')
+# message follows `YYYY-MM-DD HH:MM: ` prefix
+MESSAGE_START = DATETIME_LEN + 2
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_epoch_days(year, month, day):
+    return dt.date(year, month, day).toordinal() - EPOCH_ORDINAL
+
+
+class EntryView():
+    """
+    Log line in a shared bytes buffer, e.g. memory mapped log file, which
+    is parsed only as much as needed
+
+    View keeps only offsets of the line in the buffer: time and slack mark
+    are read right from the buffer bytes, project and log strings are
+    decoded and stripped only when they are accessed. `end` is the offset
+    after the last char of the line, without new line chars.
+    """
+    __slots__ = ('buf', 'start', 'end', '_separator', '_view')
+
+    def __init__(self, buf, start=0, end=None):
+        self.buf = buf
+        self._view = None
+        self.start = start
+        self.end = len(buf) if end is None else end
+        self._separator = None
+
+    def move(self, start, end):
+        "Moves view to other line of the same buffer"
+        self.start = start
+        self.end = end
+        self._separator = None
+
+    def _number(self, begin, end):
+        buf = self.buf
+        value = 0
+        for i in range(self.start + begin, self.start + end):
+            digit = buf[i] - ZERO
+            if not 0 <= digit <= 9:
+                raise ValueError("Malformed log line")
+            value = value * 10 + digit
+        return value
+
+    @property
+    def minutes(self):
+        "Returns time of the entry in minutes since epoch"
+        if self.end - self.start < DATETIME_LEN:
+            raise ValueError("Malformed log line")
+        days = _get_epoch_days(self._number(0, 4), self._number(5, 7),
+                               self._number(8, 10))
+        return (days * MINUTES_IN_DAY +
+                self._number(11, 13) * 60 + self._number(14, 16))
+
+    @property
+    def date(self):
+        return bytes(self.buf[self.start:self.start + DATE_LEN]).decode()
+
+    @property
+    def time(self):
+        return bytes(
+            self.buf[self.start + DATE_LEN + 1:self.start + DATETIME_LEN]
+        ).decode()
+
+    def _message_bounds(self):
+        "Returns offsets of project and log, log is None if there is none"
+        message_start = min(self.start + MESSAGE_START, self.end)
+        if self._separator is None:
+            separator = self.buf.find(b': ', message_start, self.end)
+            self._separator = self.end if separator < 0 else separator
+        if self._separator == self.end:
+            return message_start, self.end, None
+        return message_start, self._separator, self._separator + 2
+
+    def _ends_with_slack(self, begin, end):
+        buf = self.buf
+        return (end - begin >= 2 and buf[end - 1] == ASTERISK and
+                buf[end - 2] == ASTERISK)
+
+    @property
+    def is_slack(self):
+        project_start, project_end, log_start = self._message_bounds()
+        return (self._ends_with_slack(project_start, project_end) or
+                (log_start is not None and
+                 self._ends_with_slack(log_start, self.end)))
+
+    @property
+    def project_bytes(self):
+        "Returns project bytes as they are, with slack marks"
+        project_start, project_end, _ = self._message_bounds()
+        return bytes(self.buf[project_start:project_end])
+
+    @property
+    def log_bytes(self):
+        "Returns log bytes as they are, with slack marks"
+        _, _, log_start = self._message_bounds()
+        if log_start is None:
+            return b''
+        return bytes(self.buf[log_start:self.end])
+
+    def _raw_view(self, begin, end):
+        if self._view is None:
+            self._view = memoryview(self.buf)
+        return self._view[begin:end]
+
+    @property
+    def project_view(self):
+        """
+        Returns project bytes as they are, as memoryview of the buffer
+
+        Memoryview of read only buffer, e.g. bytes, is hashable and equal
+        to bytes, so it can be looked up in dict of bytes without copying.
+        """
+        project_start, project_end, _ = self._message_bounds()
+        return self._raw_view(project_start, project_end)
+
+    @property
+    def log_view(self):
+        "Returns log bytes as they are, as memoryview of the buffer"
+        _, _, log_start = self._message_bounds()
+        if log_start is None:
+            return self._raw_view(0, 0)
+        return self._raw_view(log_start, self.end)
+
+    @property
+    def project(self):
+        "Returns project without slack marks"
+        return strip_log(self.project_bytes.decode('utf-8'))
+
+    @property
+    def log(self):
+        "Returns log without slack marks"
+        return strip_log(self.log_bytes.decode('utf-8'))
+
+    def line(self):
+        "Returns `Line` of the entry, project and log are without slack marks"
+        return Line(self.date, self.time, self.project, self.log,
+                    self.is_slack)
+
+
+def iter_line_bounds(buf, start=0, end=None):
+    """
+    Yields (<line start>, <line end>, <next line start>) offsets of non
+    empty lines of the buffer, line end is before new line chars
+
+    Last line may have no new line char at the end, then its next line
+    start is None.
+    """
+    if end is None:
+        end = len(buf)
+    while start < end:
+        newline = buf.find(b'\n', start, end)
+        next_start = None if newline < 0 else newline + 1
+        line_end = end if newline < 0 else newline
+        while line_end > start and buf[line_end - 1] == CARRIAGE_RETURN:
+            line_end -= 1
+        # lines of spaces only are as empty as empty lines
+        if line_end > start and (buf[start] > SPACE or
+                                 bytes(buf[start:line_end]).strip()):
+            yield start, line_end, next_start
+        if next_start is None:
+            break
+        start = next_start
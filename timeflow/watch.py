@@ -0,0 +1,195 @@
+import ctypes
+import ctypes.util
+import datetime as dt
+import os
+import select
+import time
+
+from timeflow import snapshot
+from timeflow import utils
+from timeflow.binlog import read_log_entries
+from timeflow.stats import get_total_stats_times
+from timeflow.stats import iter_entry_times
+
+# how often log file is checked, if inotify is not available
+POLL_INTERVAL = 1
+# how often stats are redrawn, even if log has not changed, as today's
+# working time changes every minute
+REDRAW_INTERVAL = 60
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def inotify_watch(path):
+    """
+    Returns inotify file descriptor, watching directory of the file at `path`
+
+    Directory is watched, as editors often replace the file instead of
+    writing to it. Returns None if inotify is not available.
+    """
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(libc, 'inotify_init'):
+        return None
+    fd = libc.inotify_init()
+    if fd < 0:
+        return None
+    directory = os.path.dirname(os.path.abspath(path))
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def wait_for_change(path, timeout, inotify_fd=None, stat_key=None):
+    """
+    Waits until file at `path` changes, but no longer than `timeout` seconds
+
+    Uses inotify file descriptor if it's given, otherwise checks file's
+    stat every `POLL_INTERVAL` seconds. File is compared to its `stat_key`,
+    e.g. when it was read last time, or to its current stat by default.
+    Returns True if file has changed.
+    """
+    if stat_key is None:
+        stat_key = _stat_key(path)
+    elif _stat_key(path) != stat_key:
+        return True
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        if inotify_fd is not None:
+            readable, _, _ = select.select([inotify_fd], [], [], remaining)
+            if readable:
+                # events are not looked at, only file's stat matters
+                os.read(inotify_fd, 4096)
+        else:
+            time.sleep(min(POLL_INTERVAL, remaining))
+        if _stat_key(path) != stat_key:
+            return True
+
+
+class StatsWatcher():
+    """
+    Keeps totals of work and slack time of the date range up to date with
+    the log file
+
+    On update only entries appended to the log are parsed and added to the
+    totals. Totals are calculated again only if log file was rewritten.
+    """
+    def __init__(self, log_file, date_from, date_to,
+                 filter_projects=[], exclude_projects=[], where=None):
+        self.log_file = log_file
+        self.date_from = date_from
+        self.date_to = date_to
+        self.filter_projects = filter_projects
+        self.exclude_projects = exclude_projects
+        self.where = where
+        self.entries = None
+        self.work_time = 0
+        self.slack_time = 0
+        self._stat_key = None
+        self._should_be_in_stats = None
+        self._matches_query = None
+        # entries before this index are already counted
+        self._counted = 0
+        self._today_start = None
+
+    def update(self):
+        "Updates totals with appended entries, returns True if they changed"
+        stat_key = _stat_key(self.log_file)
+        if self.entries is not None and stat_key == self._stat_key:
+            return False
+        self._stat_key = stat_key
+
+        if self.entries is None:
+            entries = snapshot.update_snapshot(self.log_file)
+        else:
+            with open(self.log_file, 'rb') as fp:
+                entries = read_log_entries(fp, self.entries)
+
+        begin, end = entries.date_range(self.date_from, self.date_to)
+        if entries is not self.entries:
+            # log file was rewritten, so everything is counted again
+            self.entries = entries
+            self.work_time = self.slack_time = 0
+            self._counted = begin
+            self._should_be_in_stats = entries.project_filter(
+                self.filter_projects, self.exclude_projects
+            )
+            if self.where:
+                self._matches_query = self.where.entries_predicate(entries)
+        self._today_start = entries.minutes[begin] if begin < end else None
+
+        # incomplete last line is counted, when it's complete
+        end = min(end, len(entries) - entries.partial)
+        start = max(begin, self._counted - 1)
+        for i, seconds in iter_entry_times(entries, start, end,
+                                           self._should_be_in_stats,
+                                           self._matches_query):
+            if entries.slack[i]:
+                self.slack_time += seconds
+            else:
+                self.work_time += seconds
+        self._counted = max(self._counted, end)
+        return True
+
+    def today_work_time(self, now=None):
+        "Returns time passed since the first entry in date range"
+        if self._today_start is None:
+            return None
+        today_start_time = utils.epoch_minutes_to_datetime(self._today_start)
+        return ((now or dt.datetime.now()) - today_start_time).seconds
+
+    def get_output(self, today=False):
+        return get_total_stats_times(
+            [self.work_time], [self.slack_time],
+            self.today_work_time() if today else None,
+        )
+
+
+def watch_stats(date_from, date_to, filter_projects, exclude_projects,
+                today=False, where=None):
+    """
+    Shows stats and redraws them, whenever log file changes
+
+    Today's stats follow the current date, when day changes.
+    """
+    inotify_fd = inotify_watch(utils.LOG_FILE)
+    watcher = None
+    try:
+        while True:
+            if today:
+                date_from = date_to = dt.datetime.now().strftime(
+                    utils.DATE_FORMAT
+                )
+            if watcher is None or watcher.date_from != date_from:
+                watcher = StatsWatcher(utils.LOG_FILE, date_from, date_to,
+                                       filter_projects, exclude_projects,
+                                       where=where)
+            watcher.update()
+            # clear terminal and draw stats from the top
+            print("\033[H\033[J" + watcher.get_output(today=today),
+                  flush=True)
+            # changes made since the log was read are not waited for
+            wait_for_change(utils.LOG_FILE, REDRAW_INTERVAL, inotify_fd,
+                            stat_key=watcher._stat_key)
+    finally:
+        if inotify_fd is not None:
+            os.close(inotify_fd)